@@ -0,0 +1,287 @@
+"""
+Compact, memory-mapped ZIP code and enrollment site reference data.
+
+The build_locations management command compiles CSV reference data into a
+binary file of fixed-width little-endian columns plus a deduplicated string
+table. Workers memory-map the file read-only, so every worker on an instance
+shares one copy through the OS page cache. A rebuilt file that replaces the
+old one is picked up without a restart.
+
+File layout, with every section starting on an 8 byte boundary:
+    header          HEADER
+    zip_codes       uint32[zip_count], sorted
+    zip_latitudes   float32[zip_count]
+    zip_longitudes  float32[zip_count]
+    site_latitudes  float32[site_count]
+    site_longitudes float32[site_count]
+    site_strings    uint32[site_count * len(SITE_FIELDS)], string table indexes
+    string_offsets  uint32[string_count + 1], byte offsets into string_data
+    string_data     utf-8 bytes
+"""
+import bisect
+import heapq
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+from django.conf import settings
+
+MAGIC = b"IDEMLOC\0"
+FORMAT_VERSION = 1
+# magic, format version, zip count, site count, string count, data version
+HEADER = struct.Struct("<8sIIIIQ")
+
+SITE_FIELDS = (
+    "title",
+    "address",
+    "address2",
+    "city",
+    "state",
+    "postalCode",
+    "hours",
+    "phone",
+)
+
+EARTH_RADIUS_MILES = 3958.8
+
+
+class LocationDataError(Exception):
+    """ Raised when a location data file cannot be read """
+
+
+def _align(offset) -> int:
+    return (offset + 7) & ~7
+
+
+def _section_offsets(zip_count, site_count, string_count) -> dict:
+    """ Byte offsets of each section for the given counts """
+    sizes = [
+        ("zip_codes", 4 * zip_count),
+        ("zip_latitudes", 4 * zip_count),
+        ("zip_longitudes", 4 * zip_count),
+        ("site_latitudes", 4 * site_count),
+        ("site_longitudes", 4 * site_count),
+        ("site_strings", 4 * site_count * len(SITE_FIELDS)),
+        ("string_offsets", 4 * (string_count + 1)),
+    ]
+    offsets = {}
+    offset = _align(HEADER.size)
+    for name, size in sizes:
+        offsets[name] = offset
+        offset = _align(offset + size)
+    offsets["string_data"] = offset
+    return offsets
+
+
+def parse_zipcode(zipcode):
+    """ Return the integer ZIP5 for a ZIP or ZIP+4 string, or None if malformed """
+    zip5 = str(zipcode).split("-")[0].strip()
+    if not zip5.isdigit() or len(zip5) > 5:
+        return None
+    return int(zip5)
+
+
+def write_location_data(path, zips, sites, data_version):
+    """
+    Compile reference data into a location data file. zips is an iterable of
+    (zipcode, latitude, longitude) and sites an iterable of dicts with the
+    SITE_FIELDS plus latitude and longitude. The file is written beside path
+    and moved into place so readers never see a partial file.
+    """
+    rows = []
+    for zipcode, lat, lon in zips:
+        zip5 = parse_zipcode(zipcode)
+        if zip5 is None:
+            raise LocationDataError("Malformed ZIP code: %r" % zipcode)
+        rows.append((zip5, lat, lon))
+    zips = sorted(rows)
+    sites = list(sites)
+
+    strings = {}
+    site_strings = []
+    for site in sites:
+        for field in SITE_FIELDS:
+            site_strings.append(strings.setdefault(site.get(field) or "", len(strings)))
+
+    encoded = [value.encode() for value in strings]
+    string_offsets = [0]
+    for value in encoded:
+        string_offsets.append(string_offsets[-1] + len(value))
+
+    offsets = _section_offsets(len(zips), len(sites), len(encoded))
+    sections = [
+        ("zip_codes", "I", [row[0] for row in zips]),
+        ("zip_latitudes", "f", [float(row[1]) for row in zips]),
+        ("zip_longitudes", "f", [float(row[2]) for row in zips]),
+        ("site_latitudes", "f", [float(site["latitude"]) for site in sites]),
+        ("site_longitudes", "f", [float(site["longitude"]) for site in sites]),
+        ("site_strings", "I", site_strings),
+        ("string_offsets", "I", string_offsets),
+    ]
+
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, "wb") as data_file:
+        data_file.write(
+            HEADER.pack(
+                MAGIC, FORMAT_VERSION, len(zips), len(sites), len(encoded), data_version
+            )
+        )
+        for name, code, values in sections:
+            data_file.seek(offsets[name])
+            data_file.write(struct.pack("<%d%s" % (len(values), code), *values))
+        data_file.seek(offsets["string_data"])
+        data_file.write(b"".join(encoded))
+    os.replace(temp_path, path)
+
+
+def haversine_miles(lat1, lon1, lat2, lon2) -> float:
+    """ Great-circle distance between two points in miles """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+class LocationData:
+    """ Read-only view of a memory-mapped location data file """
+
+    def __init__(self, path):
+        if sys.byteorder != "little":
+            raise LocationDataError("Location data requires a little-endian host")
+        with open(path, "rb") as data_file:
+            stat = os.fstat(data_file.fileno())
+            self.file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if stat.st_size < HEADER.size:
+                raise LocationDataError("%s is not a location data file" % path)
+            self._map = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._map.size() < HEADER.size:
+            raise LocationDataError("%s is not a location data file" % path)
+        (
+            magic,
+            file_format,
+            zip_count,
+            site_count,
+            string_count,
+            version,
+        ) = HEADER.unpack_from(self._map)
+        if magic != MAGIC or file_format != FORMAT_VERSION:
+            raise LocationDataError("%s is not a location data file" % path)
+        self.version = version
+        self.zip_count = zip_count
+        self.site_count = site_count
+
+        offsets = _section_offsets(zip_count, site_count, string_count)
+        if self._map.size() < offsets["string_data"]:
+            raise LocationDataError("%s is truncated" % path)
+        view = memoryview(self._map)
+
+        def column(name, code, count):
+            return view[offsets[name] : offsets[name] + 4 * count].cast(code)
+
+        self.zip_codes = column("zip_codes", "I", zip_count)
+        self.zip_latitudes = column("zip_latitudes", "f", zip_count)
+        self.zip_longitudes = column("zip_longitudes", "f", zip_count)
+        self.site_latitudes = column("site_latitudes", "f", site_count)
+        self.site_longitudes = column("site_longitudes", "f", site_count)
+        self.site_strings = column("site_strings", "I", site_count * len(SITE_FIELDS))
+        self.string_offsets = column("string_offsets", "I", string_count + 1)
+        self.string_data = view[offsets["string_data"] :]
+
+    def string(self, index) -> str:
+        """ Decode an entry from the string table """
+        start = self.string_offsets[index]
+        end = self.string_offsets[index + 1]
+        return str(self.string_data[start:end], "utf-8")
+
+    def centroid(self, zipcode):
+        """ Return the (latitude, longitude) of a ZIP code, or None if unknown """
+        zip5 = parse_zipcode(zipcode)
+        if zip5 is None:
+            return None
+        index = bisect.bisect_left(self.zip_codes, zip5)
+        if index == self.zip_count or self.zip_codes[index] != zip5:
+            return None
+        return self.zip_latitudes[index], self.zip_longitudes[index]
+
+    def site(self, index, distance) -> dict:
+        """ Build the API representation of a site """
+        base = index * len(SITE_FIELDS)
+        location = {
+            field: self.string(self.site_strings[base + position])
+            for position, field in enumerate(SITE_FIELDS)
+        }
+        # Keep the key order of the /locations response
+        return {
+            **{field: location[field] for field in SITE_FIELDS[:6]},
+            "distance": str(distance),
+            "hours": location["hours"],
+            "phone": location["phone"],
+            "geocode": {
+                "latitude": "%.6f" % self.site_latitudes[index],
+                "longitude": "%.6f" % self.site_longitudes[index],
+            },
+        }
+
+    def nearest(self, zipcode, limit) -> list:
+        """ Return up to limit sites nearest to a ZIP code's centroid """
+        centroid = self.centroid(zipcode)
+        if centroid is None:
+            return []
+        lat, lon = centroid
+        # Shortlist by a cheap flat-earth approximation, then rank exactly
+        lon_scale = math.cos(math.radians(lat)) ** 2
+        latitudes, longitudes = self.site_latitudes, self.site_longitudes
+        shortlist = heapq.nsmallest(
+            limit * 4,
+            range(self.site_count),
+            key=lambda i: (latitudes[i] - lat) ** 2
+            + (longitudes[i] - lon) ** 2 * lon_scale,
+        )
+        nearest = sorted(
+            (haversine_miles(lat, lon, latitudes[i], longitudes[i]), i)
+            for i in shortlist
+        )[:limit]
+        return [self.site(index, distance) for distance, index in nearest]
+
+
+_location_data = None
+_checked_at = 0.0
+
+
+def get_location_data() -> LocationData:
+    """
+    Return the process's LocationData, reopening it at most every
+    settings.LOCATIONS_RELOAD_INTERVAL seconds if the file has been replaced.
+    If the file cannot be reloaded, the last good data keeps being served.
+    Raises LocationDataError only if no data has been loaded yet.
+    """
+    global _location_data, _checked_at  # pylint: disable=global-statement
+    now = time.monotonic()
+    if (
+        _location_data is None
+        or now - _checked_at >= settings.LOCATIONS_RELOAD_INTERVAL
+    ):
+        _checked_at = now
+        try:
+            stat = os.stat(settings.LOCATIONS_DATA_FILE)
+            file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if _location_data is None or _location_data.file_id != file_id:
+                _location_data = LocationData(settings.LOCATIONS_DATA_FILE)
+                logging.info("Loaded location data version %d", _location_data.version)
+        except (OSError, LocationDataError) as error:
+            if _location_data is None:
+                raise LocationDataError(
+                    "Cannot load location data: %s" % error
+                ) from error
+            logging.error(
+                "Cannot reload location data, serving version %d: %s",
+                _location_data.version,
+                error,
+            )
+    return _location_data
@@ -0,0 +1,35 @@
+""" Report per-CSP admission control counters for this instance """
+import json
+from django.core.management.base import BaseCommand
+from idemia.admission import get_admission_table
+
+
+class Command(BaseCommand):
+    """ Print the shared admission control table, one CSP per line """
+
+    help = "Print per-CSP admission, queueing and rejection counts for this instance"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--json", action="store_true", help="Print the counters as JSON"
+        )
+
+    def handle(self, *args, **options):
+        stats = sorted(get_admission_table().stats(), key=lambda row: row["csp_id"])
+        if options["json"]:
+            self.stdout.write(json.dumps(stats))
+            return
+
+        columns = [
+            "csp_id",
+            "in_flight",
+            "admitted",
+            "queued",
+            "rejected_rate",
+            "rejected_concurrency",
+        ]
+        self.stdout.write(" ".join(column.ljust(20) for column in columns))
+        for row in stats:
+            self.stdout.write(
+                " ".join(str(row[column]).ljust(20) for column in columns)
+            )
@@ -0,0 +1,62 @@
+""" Benchmark response compression of API payloads at each level """
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from idemia.compression import CODECS, LEVELS
+
+PAYLOAD_PATHS = ["/locations/20166", "/doc.json", "/doc.yaml", "/doc/"]
+
+
+class Command(BaseCommand):
+    """ Report CPU time against compressed size for each encoding and level """
+
+    help = (
+        "Fetch API payloads and report the compressed size and CPU time of each "
+        "available encoding at each level, to choose COMPRESSION_LEVELS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths", nargs="*", default=PAYLOAD_PATHS, help="Paths to fetch"
+        )
+        parser.add_argument("--repeats", type=int, default=20)
+        parser.add_argument(
+            "--encoding", choices=list(CODECS), action="append", dest="encodings"
+        )
+
+    def handle(self, *args, **options):
+        client = Client()
+        for path in options["paths"]:
+            response = client.get(path)
+            if response.status_code != 200 or response.streaming:
+                raise CommandError("GET %s returned %d" % (path, response.status_code))
+            content = response.content
+
+            self.stdout.write("%s: %d bytes" % (path, len(content)))
+            self.stdout.write("  encoding level     bytes  ratio   cpu ms   MB/s")
+            for encoding in options["encodings"] or CODECS:
+                for level in LEVELS[encoding]:
+                    compressed_size, cpu_ms = self.measure(
+                        encoding, level, content, options["repeats"]
+                    )
+                    self.stdout.write(
+                        "  %-8s %5d %9d %6.2f %8.3f %6.1f"
+                        % (
+                            encoding,
+                            level,
+                            compressed_size,
+                            len(content) / compressed_size,
+                            cpu_ms,
+                            len(content) / 2**20 / (cpu_ms / 1000),
+                        )
+                    )
+
+    @staticmethod
+    def measure(encoding, level, content, repeats):
+        """ Compressed size and mean CPU milliseconds to compress content """
+        compress = CODECS[encoding]
+        start = time.process_time()
+        for _ in range(repeats):
+            compressed = compress(content, level)
+        cpu_ms = (time.process_time() - start) * 1000 / repeats
+        return len(compressed), max(cpu_ms, 0.001)
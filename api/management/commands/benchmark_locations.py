@@ -0,0 +1,146 @@
+""" Benchmark loading memory-mapped location data against loading JSON """
+import json
+import os
+import random
+import tempfile
+import time
+from django.core.management.base import BaseCommand, CommandError
+from api.locations import LocationData, write_location_data
+
+
+def anonymous_memory_mb():
+    """
+    Memory of this process that cannot be shared through the page cache, in
+    MB, or None where /proc/self/smaps_rollup is unavailable.
+    """
+    try:
+        with open("/proc/self/smaps_rollup") as rollup:
+            for line in rollup:
+                if line.startswith("Anonymous:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def synthetic_reference_data(zip_count, site_count, seed=0):
+    """ Generate plausible ZIP centroids and enrollment sites """
+    rng = random.Random(seed)
+    zips = [
+        ("%05d" % zipcode, rng.uniform(25, 49), rng.uniform(-124, -67))
+        for zipcode in sorted(rng.sample(range(501, 99951), zip_count))
+    ]
+    hours = [
+        "Monday-Friday: 8:00 AM - 1:00 PM & 2:00 PM - 4:30 PM",
+        "Monday-Friday: 10:00 AM - 12:00 PM & 1:00 PM - 5:00 PM",
+        "Monday-Thursday: 10:00 AM - 12:00 PM & 1:00 PM - 6:00 PM",
+    ]
+    sites = []
+    for index in range(site_count):
+        zipcode, lat, lon = rng.choice(zips)
+        sites.append(
+            {
+                "title": "IdentoGO Enrollment Center %d" % index,
+                "address": "%d Main St" % rng.randint(1, 9999),
+                "address2": rng.choice(["", "Ste %d" % rng.randint(1, 500)]),
+                "city": "City %d" % rng.randint(1, 5000),
+                "state": rng.choice(["VA", "MD", "DC", "CA", "TX", "NY"]),
+                "postalCode": "%s-%04d" % (zipcode, rng.randint(0, 9999)),
+                "hours": rng.choice(hours),
+                "phone": "855-%03d-%04d" % (rng.randint(0, 999), rng.randint(0, 9999)),
+                "latitude": lat + rng.uniform(-0.1, 0.1),
+                "longitude": lon + rng.uniform(-0.1, 0.1),
+            }
+        )
+    return zips, sites
+
+
+class Command(BaseCommand):
+    """ Measure location data startup time, lookup latency and memory """
+
+    help = (
+        "Build synthetic location data, then report the time and unshareable "
+        "memory needed to load it memory-mapped and from JSON. Fails if "
+        "the memory-mapped loader exceeds the given limits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--zips", type=int, default=41000)
+        parser.add_argument("--sites", type=int, default=5000)
+        parser.add_argument("--lookups", type=int, default=100)
+        parser.add_argument(
+            "--max-startup-ms",
+            type=float,
+            default=50,
+            help="Fail if opening the memory-mapped file takes longer",
+        )
+        parser.add_argument(
+            "--max-memory-mb",
+            type=float,
+            default=20,
+            help="Fail if loading and querying the file adds more anonymous memory",
+        )
+
+    def handle(self, *args, **options):
+        zips, sites = synthetic_reference_data(options["zips"], options["sites"])
+        sample = random.sample(zips, min(10, len(zips)))
+        lookups = [zipcode for zipcode, _lat, _lon in sample]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "locations.bin")
+            write_location_data(path, zips, sites, data_version=1)
+            self.stdout.write(
+                "%d ZIP codes, %d sites: %.1f MB file"
+                % (len(zips), len(sites), os.path.getsize(path) / 2**20)
+            )
+
+            mmap_before = anonymous_memory_mb()
+            start = time.perf_counter()
+            location_data = LocationData(path)
+            startup_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            for index in range(options["lookups"]):
+                location_data.nearest(lookups[index % len(lookups)], 5)
+            lookup_ms = (time.perf_counter() - start) * 1000 / options["lookups"]
+            mmap_after = anonymous_memory_mb()
+            del location_data
+
+        self.stdout.write(
+            "mmap:  startup %.2f ms, lookup %.2f ms, memory %s"
+            % (startup_ms, lookup_ms, self.memory_delta(mmap_before, mmap_after))
+        )
+
+        reference_json = json.dumps({"zips": zips, "sites": sites})
+        memory_before = anonymous_memory_mb()
+        start = time.perf_counter()
+        reference_dicts = json.loads(reference_json)
+        zip_dict = {
+            zipcode: (lat, lon) for zipcode, lat, lon in reference_dicts["zips"]
+        }
+        dict_ms = (time.perf_counter() - start) * 1000
+        dict_memory = self.memory_delta(memory_before, anonymous_memory_mb())
+        del reference_dicts, zip_dict
+        self.stdout.write("json:  startup %.2f ms, memory %s" % (dict_ms, dict_memory))
+
+        failures = []
+        if startup_ms > options["max_startup_ms"]:
+            failures.append(
+                "startup %.2f ms > %.2f ms" % (startup_ms, options["max_startup_ms"])
+            )
+        if mmap_before is not None and mmap_after - mmap_before > (
+            options["max_memory_mb"]
+        ):
+            failures.append(
+                "memory %.1f MB > %.1f MB"
+                % (mmap_after - mmap_before, options["max_memory_mb"])
+            )
+        if failures:
+            raise CommandError("Location data benchmark failed: " + "; ".join(failures))
+
+    @staticmethod
+    def memory_delta(before, after) -> str:
+        """ Format a change in anonymous memory """
+        if before is None or after is None:
+            return "unavailable"
+        return "%+.1f MB" % (after - before)
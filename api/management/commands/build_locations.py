@@ -0,0 +1,55 @@
+""" Compile ZIP code and site CSV reference data into a location data file """
+import csv
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from api.locations import SITE_FIELDS, LocationDataError, write_location_data
+
+
+class Command(BaseCommand):
+    """ Build the memory-mapped location data file read by /locations """
+
+    help = (
+        "Compile ZIP code centroids (zipcode,latitude,longitude) and enrollment "
+        "sites (%s,latitude,longitude) from CSV files into a location data file"
+        % ",".join(SITE_FIELDS)
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("zips", help="CSV file of ZIP code centroids")
+        parser.add_argument("sites", help="CSV file of enrollment sites")
+        parser.add_argument(
+            "--output",
+            default=settings.LOCATIONS_DATA_FILE,
+            help="Location data file to write (default: LOCATIONS_DATA_FILE)",
+        )
+        parser.add_argument(
+            "--data-version",
+            type=int,
+            default=None,
+            help="Version number stored in the file (default: current unix time)",
+        )
+
+    def handle(self, *args, **options):
+        if not options["output"]:
+            raise CommandError("Set --output or the LOCATIONS_DATA_FILE variable")
+
+        with open(options["zips"], newline="") as zips_file:
+            zips = [
+                (row["zipcode"], row["latitude"], row["longitude"])
+                for row in csv.DictReader(zips_file)
+            ]
+        with open(options["sites"], newline="") as sites_file:
+            sites = list(csv.DictReader(sites_file))
+
+        data_version = options["data_version"]
+        if data_version is None:
+            data_version = int(time.time())
+        try:
+            write_location_data(options["output"], zips, sites, data_version)
+        except (LocationDataError, KeyError, ValueError) as error:
+            raise CommandError("Invalid reference data: %s" % error) from error
+        self.stdout.write(
+            "Wrote %d ZIP codes and %d sites to %s (version %d)"
+            % (len(zips), len(sites), options["output"], data_version)
+        )
@@ -0,0 +1,109 @@
+""" Manage the monthly partitions of the enrollment record table """
+import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from api.partitioning import (
+    add_months,
+    convert_table,
+    create_partition,
+    create_partitions,
+    default_partition_months,
+    delete_expired_keys,
+    expire_partitions,
+    is_partitioned,
+    list_partitions,
+    month_start,
+)
+
+
+class Command(BaseCommand):
+    """ List, create and expire enrollment record partitions """
+
+    help = (
+        "Manage enrollment record partitions. 'list' lists monthly partitions, "
+        "'convert' partitions an unpartitioned table, 'create' creates partitions "
+        "for upcoming months and for months with rows in the default partition, "
+        "and 'expire' detaches (or with --drop, drops) partitions older than the "
+        "retention period, then deletes their records' uniqueness keys in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["list", "convert", "create", "expire"])
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=settings.ENROLLMENT_PARTITION_MONTHS_AHEAD,
+            help="Months of partitions to create after the current month",
+        )
+        parser.add_argument(
+            "--retention-months",
+            type=int,
+            default=settings.ENROLLMENT_RETENTION_MONTHS,
+            help="Complete months of records kept by 'expire'",
+        )
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Drop expired partitions instead of only detaching them",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="Uniqueness keys deleted per transaction by 'expire'",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Partitioning requires a PostgreSQL database")
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            partitioned = is_partitioned(cursor)
+            if options["action"] == "convert":
+                if partitioned:
+                    self.stdout.write("Enrollment records are already partitioned")
+                    return
+                convert_table(cursor, options["months_ahead"])
+                self.stdout.write("Converted enrollment records to partitions")
+                return
+            if not partitioned:
+                raise CommandError(
+                    "Enrollment records are not partitioned, run 'convert' first"
+                )
+
+            if options["action"] in ("create", "expire"):
+                # Move rows that missed their month's partition out of the default
+                for month in default_partition_months(cursor):
+                    name = create_partition(cursor, month)
+                    self.stdout.write("Moved default partition rows to %s" % name)
+
+            if options["action"] == "list":
+                for _month, name in list_partitions(cursor):
+                    self.stdout.write(name)
+            elif options["action"] == "create":
+                this_month = month_start(datetime.date.today())
+                for name in create_partitions(
+                    cursor, this_month, add_months(this_month, options["months_ahead"])
+                ):
+                    self.stdout.write("Partition %s ready" % name)
+            else:
+                if options["retention_months"] <= 0:
+                    raise CommandError(
+                        "Set --retention-months or ENROLLMENT_RETENTION_MONTHS"
+                    )
+                for name in expire_partitions(
+                    cursor, options["retention_months"], options["drop"]
+                ):
+                    self.stdout.write(
+                        "%s partition %s"
+                        % ("Dropped" if options["drop"] else "Detached", name)
+                    )
+
+        if options["action"] == "expire":
+            # Outside the transaction above, so each batch commits separately
+            with connection.cursor() as cursor:
+                deleted = delete_expired_keys(
+                    cursor, options["retention_months"], options["batch_size"]
+                )
+            self.stdout.write("Deleted %d expired uniqueness keys" % deleted)
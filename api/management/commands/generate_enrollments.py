@@ -0,0 +1,109 @@
+""" Bulk-load synthetic enrollment records for scale testing """
+import datetime
+import io
+import random
+import string
+import time
+import uuid
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from api.models import EnrollmentStatus
+from api.partitioning import create_partitions, is_partitioned
+
+# Share of records in each status, roughly matching a mature deployment
+STATUS_WEIGHTS = {
+    EnrollmentStatus.PENDING: 0.25,
+    EnrollmentStatus.IN_PROGRESS: 0.15,
+    EnrollmentStatus.SUCCESSFUL: 0.5,
+    EnrollmentStatus.FAILED: 0.1,
+}
+
+COPY_SQL = (
+    "COPY api_enrollmentrecord (record_csp_id, record_csp_uuid, record_idemia_ueid, "
+    "record_status, creation_date, last_modified) FROM STDIN"
+)
+
+
+def csp_ids(count) -> list:
+    """ Names of the synthetic CSPs """
+    return ["csp-%04d" % index for index in range(count)]
+
+
+def generate_rows(rng, count, csps, days, now):
+    """
+    Yield tab-separated COPY rows. CSP volumes follow a long tail so a few
+    CSPs own most records, and creation dates are spread over the last days.
+    """
+    csp_weights = [1 / (rank + 1) for rank in range(len(csps))]
+    statuses = [status.value for status in STATUS_WEIGHTS]
+    status_weights = list(STATUS_WEIGHTS.values())
+    alphabet = string.ascii_uppercase + string.digits
+    window = days * 86400
+    for chunk_start in range(0, count, 10000):
+        chunk = min(10000, count - chunk_start)
+        for csp_id, status in zip(
+            rng.choices(csps, csp_weights, k=chunk),
+            rng.choices(statuses, status_weights, k=chunk),
+        ):
+            created = now - datetime.timedelta(seconds=rng.random() * window)
+            modified = min(now, created + datetime.timedelta(hours=rng.random() * 72))
+            yield "%s\t%s\t%s\t%s\t%s\t%s\n" % (
+                csp_id,
+                uuid.UUID(int=rng.getrandbits(128), version=4),
+                "".join(rng.choices(alphabet, k=10)),
+                status,
+                created.isoformat(),
+                modified.isoformat(),
+            )
+
+
+class Command(BaseCommand):
+    """ Load synthetic EnrollmentRecord rows with PostgreSQL COPY """
+
+    help = "Bulk-load synthetic enrollment records across many CSPs using COPY"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=1000000)
+        parser.add_argument("--csps", type=int, default=50)
+        parser.add_argument(
+            "--days", type=int, default=365, help="Spread creation dates over this"
+        )
+        parser.add_argument("--batch-size", type=int, default=100000)
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("generate_enrollments requires a PostgreSQL database")
+
+        rng = random.Random(options["seed"])  # nosec - not security related
+        now = timezone.now()
+        start = time.perf_counter()
+        with connection.cursor() as cursor:
+            if is_partitioned(cursor):
+                create_partitions(
+                    cursor,
+                    (now - datetime.timedelta(days=options["days"])).date(),
+                    now.date(),
+                )
+
+            rows = generate_rows(
+                rng, options["count"], csp_ids(options["csps"]), options["days"], now
+            )
+            loaded = 0
+            while loaded < options["count"]:
+                batch = io.StringIO()
+                size = min(options["batch_size"], options["count"] - loaded)
+                for _ in range(size):
+                    batch.write(next(rows))
+                batch.seek(0)
+                cursor.copy_expert(COPY_SQL, batch)
+                loaded += size
+                if options["verbosity"] > 1:
+                    self.stdout.write("Loaded %d records" % loaded)
+            cursor.execute("ANALYZE api_enrollmentrecord")
+
+        self.stdout.write(
+            "Loaded %d records for %d CSPs in %.1fs"
+            % (loaded, options["csps"], time.perf_counter() - start)
+        )
@@ -0,0 +1,118 @@
+""" Inspect request profiles saved by the profiling middleware """
+import collections
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from idemia.profiling import list_profiles, load_profile, make_token
+
+
+class Command(BaseCommand):
+    """ List, aggregate and render saved request profiles """
+
+    help = (
+        "Inspect request profiles. 'token' prints an X-Profile-Token header value, "
+        "'list' lists saved profiles, 'aggregate' summarizes the slowest frames and "
+        "queries, and 'collapse' prints collapsed stacks for flame graph tools."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "action", choices=["token", "list", "aggregate", "collapse"]
+        )
+        parser.add_argument(
+            "profiles",
+            nargs="*",
+            help="Profile file names to include (default: all saved profiles)",
+        )
+        parser.add_argument("--csp", help="Only include profiles for this CSP ID")
+        parser.add_argument("--path", help="Only include profiles for this URL path")
+        parser.add_argument(
+            "--limit", type=int, default=20, help="Rows shown by 'aggregate'"
+        )
+
+    def handle(self, *args, **options):
+        if options["action"] == "token":
+            self.stdout.write(make_token())
+            return
+
+        profiles = self.select_profiles(options)
+        if options["action"] == "list":
+            self.list_profiles(profiles)
+        elif options["action"] == "aggregate":
+            self.aggregate(profiles, options["limit"])
+        else:
+            self.collapse(profiles)
+
+    @staticmethod
+    def select_profiles(options) -> list:
+        """ Load the profiles matching the command line filters """
+        selected = []
+        for path in list_profiles(settings.PROFILING_DIR):
+            if options["profiles"] and not any(
+                path.endswith(name) for name in options["profiles"]
+            ):
+                continue
+            try:
+                profile = load_profile(path)
+            except FileNotFoundError:
+                continue  # Pruned by a worker since it was listed
+            if options["csp"] and profile["csp_id"] != options["csp"]:
+                continue
+            if options["path"] and profile["path"] != options["path"]:
+                continue
+            profile["file"] = path.rsplit("/", 1)[-1]
+            selected.append(profile)
+        return selected
+
+    def list_profiles(self, profiles):
+        """ Print one line per profile """
+        for profile in profiles:
+            self.stdout.write(
+                "%s %s %s %s %d %.1fms %d queries"
+                % (
+                    profile["file"],
+                    profile["csp_id"],
+                    profile["method"],
+                    profile["path"],
+                    profile["status"],
+                    profile["duration"] * 1000,
+                    len(profile["queries"]),
+                )
+            )
+
+    def aggregate(self, profiles, limit):
+        """ Print the frames and queries that took the most time across profiles """
+        self_time = collections.Counter()
+        total_time = collections.Counter()
+        query_time = collections.Counter()
+        query_count = collections.Counter()
+        for profile in profiles:
+            for stack, samples in profile["stacks"].items():
+                frames = stack.split(";")
+                seconds = samples * profile["interval"]
+                self_time[frames[-1]] += seconds
+                for frame in set(frames):
+                    total_time[frame] += seconds
+            for query in profile["queries"]:
+                query_time[query["sql"]] += query["duration"]
+                query_count[query["sql"]] += 1
+
+        self.stdout.write("Profiles: %d" % len(profiles))
+        self.stdout.write("\nSelf time (ms)")
+        for frame, seconds in self_time.most_common(limit):
+            self.stdout.write("%10.1f  %s" % (seconds * 1000, frame))
+        self.stdout.write("\nTotal time (ms)")
+        for frame, seconds in total_time.most_common(limit):
+            self.stdout.write("%10.1f  %s" % (seconds * 1000, frame))
+        self.stdout.write("\nQueries (ms, count)")
+        for sql, seconds in query_time.most_common(limit):
+            self.stdout.write(
+                "%10.1f %6d  %s" % (seconds * 1000, query_count[sql], sql)
+            )
+
+    def collapse(self, profiles):
+        """ Print merged stacks in the collapsed format read by flamegraph.pl """
+        stacks = collections.Counter()
+        for profile in profiles:
+            stacks.update(profile["stacks"])
+        for stack, samples in sorted(stacks.items()):
+            self.stdout.write("%s %d" % (stack, samples))
@@ -0,0 +1,269 @@
+"""
+Monthly range partitioning of the enrollment record table on PostgreSQL.
+
+The enrollment_partitions convert command turns api_enrollmentrecord into a
+table partitioned by creation_date with one partition per month
+(api_enrollmentrecord_pYYYYMM) and a default partition for anything outside
+them. Creating a month's partition moves any of its rows
+out of the default partition, since PostgreSQL cannot attach a partition whose
+rows are in the default. Expired months are removed by detaching or dropping
+their partition instead of deleting rows one at a time.
+
+PostgreSQL can only enforce uniqueness on partitioned tables when the
+partition key is part of the constraint, so the (record_csp_uuid,
+record_csp_id) unique constraint moves to api_enrollmentrecord_key, a narrow
+table kept in step with the records by triggers. Lookups by CSP ID and UUID
+use an index on every partition. The key table is not partitioned, so the keys
+of expired records are still deleted row by row, in batches after the expired
+partitions are detached (see delete_expired_keys).
+
+Requires PostgreSQL 11 or newer.
+"""
+import datetime
+import re
+from django.db import transaction
+
+# Statements below interpolate only these names and partition names built from
+# dates, never request data, so they are marked nosec for bandit (B608)
+TABLE = "api_enrollmentrecord"
+OLD_TABLE = "api_enrollmentrecord_unpartitioned"
+KEY_TABLE = "api_enrollmentrecord_key"
+DEFAULT_PARTITION = "api_enrollmentrecord_default"
+PARTITION_PATTERN = re.compile(r"^api_enrollmentrecord_p(\d{4})(\d{2})$")
+
+PARTITIONED_TABLE_SQL = [
+    "ALTER TABLE api_enrollmentrecord RENAME TO api_enrollmentrecord_unpartitioned",
+    "ALTER TABLE api_enrollmentrecord_unpartitioned "
+    "RENAME CONSTRAINT api_enrollmentrecord_pkey "
+    "TO api_enrollmentrecord_unpartitioned_pkey",
+    "CREATE TABLE api_enrollmentrecord "
+    "(LIKE api_enrollmentrecord_unpartitioned INCLUDING DEFAULTS) "
+    "PARTITION BY RANGE (creation_date)",
+    "ALTER TABLE api_enrollmentrecord "
+    "ADD CONSTRAINT api_enrollmentrecord_pkey PRIMARY KEY (id, creation_date)",
+    "CREATE INDEX api_enrollmentrecord_csp_lookup "
+    "ON api_enrollmentrecord (record_csp_id, record_csp_uuid)",
+    "CREATE INDEX api_enrollmentrecord_creation_date "
+    "ON api_enrollmentrecord (creation_date)",
+    "CREATE TABLE api_enrollmentrecord_default "
+    "PARTITION OF api_enrollmentrecord DEFAULT",
+    """
+    CREATE TABLE api_enrollmentrecord_key (
+        record_csp_uuid uuid NOT NULL,
+        record_csp_id varchar(50) NOT NULL,
+        creation_date timestamp with time zone NOT NULL,
+        PRIMARY KEY (record_csp_uuid, record_csp_id)
+    )
+    """,
+    "CREATE INDEX api_enrollmentrecord_key_creation_date "
+    "ON api_enrollmentrecord_key (creation_date)",
+    """
+    CREATE FUNCTION api_enrollmentrecord_maintain_key() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            DELETE FROM api_enrollmentrecord_key
+            WHERE record_csp_uuid = OLD.record_csp_uuid
+            AND record_csp_id = OLD.record_csp_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO api_enrollmentrecord_key
+            VALUES (NEW.record_csp_uuid, NEW.record_csp_id, NEW.creation_date);
+        END IF;
+        RETURN NULL;
+    END
+    $$
+    """,
+    "CREATE TRIGGER api_enrollmentrecord_key_insert_delete "
+    "AFTER INSERT OR DELETE ON api_enrollmentrecord "
+    "FOR EACH ROW EXECUTE FUNCTION api_enrollmentrecord_maintain_key()",
+    "CREATE TRIGGER api_enrollmentrecord_key_update "
+    "AFTER UPDATE ON api_enrollmentrecord FOR EACH ROW "
+    "WHEN (OLD.record_csp_uuid IS DISTINCT FROM NEW.record_csp_uuid "
+    "OR OLD.record_csp_id IS DISTINCT FROM NEW.record_csp_id) "
+    "EXECUTE FUNCTION api_enrollmentrecord_maintain_key()",
+]
+
+
+def add_months(month, count) -> datetime.date:
+    """ Return the first day of the month count months after month """
+    index = month.year * 12 + month.month - 1 + count
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_start(day) -> datetime.date:
+    """ Return the first day of day's month """
+    return datetime.date(day.year, day.month, 1)
+
+
+def utc_midnight(day) -> datetime.datetime:
+    """ Return the start of day in UTC """
+    return datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc)
+
+
+def partition_name(month) -> str:
+    """ Name of the partition holding records created in month """
+    return "%s_p%04d%02d" % (TABLE, month.year, month.month)
+
+
+def is_partitioned(cursor) -> bool:
+    """ Check whether the enrollment record table is partitioned """
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+        [TABLE],
+    )
+    return cursor.fetchone() is not None
+
+
+def list_partitions(cursor) -> list:
+    """ Return (month, partition name) for each monthly partition, oldest first """
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(%s)",
+        [TABLE],
+    )
+    partitions = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_PATTERN.match(name)
+        if match:
+            month = datetime.date(int(match.group(1)), int(match.group(2)), 1)
+            partitions.append((month, name))
+    return sorted(partitions)
+
+
+def create_partition(cursor, month) -> str:
+    """
+    Create the partition for month if it does not exist. Rows for the month
+    that were written to the default partition are moved into it.
+    """
+    name = partition_name(month)
+    bounds = "FOR VALUES FROM ('%s 00:00:00+00') TO ('%s 00:00:00+00')" % (
+        month.isoformat(),
+        add_months(month, 1).isoformat(),
+    )
+    in_month = "creation_date >= %s AND creation_date < %s"
+    month_range = [utc_midnight(month), utc_midnight(add_months(month, 1))]
+
+    cursor.execute("SELECT to_regclass(%s)", [name])
+    if cursor.fetchone()[0] is not None:
+        return name
+    cursor.execute(
+        "SELECT 1 FROM %s WHERE %s LIMIT 1" % (DEFAULT_PARTITION, in_month),  # nosec
+        month_range,
+    )
+    if cursor.fetchone() is None:
+        cursor.execute("CREATE TABLE %s PARTITION OF %s %s" % (name, TABLE, bounds))
+        return name
+
+    # Fill the month's table before attaching it, so the key triggers do not
+    # fire again for rows that already have keys, and detach the default
+    # partition meanwhile so attaching does not conflict with its rows
+    with transaction.atomic(using=cursor.db.alias):
+        cursor.execute(
+            "ALTER TABLE %s DETACH PARTITION %s" % (TABLE, DEFAULT_PARTITION)
+        )
+        cursor.execute("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS)" % (name, TABLE))
+        cursor.execute(
+            "WITH moved AS (DELETE FROM %s WHERE %s RETURNING *) "  # nosec
+            "INSERT INTO %s SELECT * FROM moved" % (DEFAULT_PARTITION, in_month, name),
+            month_range,
+        )
+        cursor.execute("ALTER TABLE %s ATTACH PARTITION %s %s" % (TABLE, name, bounds))
+        cursor.execute(
+            "ALTER TABLE %s ATTACH PARTITION %s DEFAULT" % (TABLE, DEFAULT_PARTITION)
+        )
+    return name
+
+
+def default_partition_months(cursor) -> list:
+    """ Return the months that have rows in the default partition """
+    cursor.execute(
+        "SELECT DISTINCT "  # nosec
+        "date_trunc('month', creation_date AT TIME ZONE 'UTC') FROM %s ORDER BY 1"
+        % DEFAULT_PARTITION
+    )
+    return [month.date() for (month,) in cursor.fetchall()]
+
+
+def create_partitions(cursor, first_month, last_month) -> list:
+    """ Create the partitions for first_month through last_month """
+    names = []
+    month = month_start(first_month)
+    while month <= last_month:
+        names.append(create_partition(cursor, month))
+        month = add_months(month, 1)
+    return names
+
+
+def convert_table(cursor, months_ahead, today=None):
+    """
+    Replace the enrollment record table with a partitioned copy. Partitions
+    are created from the month of the oldest record through months_ahead
+    months after today, then the existing rows are copied in.
+    """
+    today = today or datetime.date.today()
+    cursor.execute(
+        "SELECT min(creation_date), pg_get_serial_sequence(%s, 'id') "  # nosec
+        "FROM " + TABLE,
+        [TABLE],
+    )
+    oldest, sequence = cursor.fetchone()
+
+    for statement in PARTITIONED_TABLE_SQL:
+        cursor.execute(statement)
+    # The id sequence belongs to the old table and would be dropped with it
+    cursor.execute("ALTER SEQUENCE %s OWNED BY %s.id" % (sequence, TABLE))
+
+    first_month = month_start(oldest.date() if oldest else today)
+    create_partitions(cursor, first_month, add_months(month_start(today), months_ahead))
+    cursor.execute("INSERT INTO %s SELECT * FROM %s" % (TABLE, OLD_TABLE))  # nosec
+    cursor.execute("DROP TABLE %s" % OLD_TABLE)
+
+
+def expiry_cutoff(retention_months, today=None) -> datetime.date:
+    """ First day of the oldest month kept with retention_months months """
+    today = today or datetime.date.today()
+    return add_months(month_start(today), -retention_months)
+
+
+def expire_partitions(cursor, retention_months, drop, today=None) -> list:
+    """
+    Detach the partitions of months that ended more than retention_months
+    months before the current month, and drop them if drop is set. Returns
+    the names of the expired partitions. The expired records' keys are left
+    for delete_expired_keys.
+    """
+    cutoff = expiry_cutoff(retention_months, today)
+    expired = []
+    for month, name in list_partitions(cursor):
+        if add_months(month, 1) > cutoff:
+            continue
+        cursor.execute("ALTER TABLE %s DETACH PARTITION %s" % (TABLE, name))
+        if drop:
+            cursor.execute("DROP TABLE %s" % name)
+        expired.append(name)
+    return expired
+
+
+def delete_expired_keys(cursor, retention_months, batch_size, today=None) -> int:
+    """
+    Delete the keys of records created before the retention cutoff that no
+    longer exist, batch_size keys per statement. Run it in autocommit mode
+    after expire_partitions so each batch commits on its own and no lock on
+    the record table is held meanwhile. Returns the number of keys deleted.
+    """
+    cutoff = utc_midnight(expiry_cutoff(retention_months, today))
+    deleted = 0
+    while True:
+        cursor.execute(
+            "DELETE FROM %(key)s WHERE ctid = ANY(ARRAY("  # nosec
+            "SELECT k.ctid FROM %(key)s k WHERE k.creation_date < %%s "
+            "AND NOT EXISTS (SELECT 1 FROM %(table)s r "
+            "WHERE r.record_csp_uuid = k.record_csp_uuid "
+            "AND r.record_csp_id = k.record_csp_id) LIMIT %%s))"
+            % {"key": KEY_TABLE, "table": TABLE},
+            [cutoff, batch_size],
+        )
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return deleted
@@ -0,0 +1,114 @@
+""" Test per-CSP admission control """
+import multiprocessing
+import os
+import tempfile
+from io import StringIO
+from django.core.management import call_command
+from django.urls import reverse
+from django.test import SimpleTestCase, override_settings
+from rest_framework import status
+from idemia import admission
+from idemia.admission import AdmissionTable, REJECTED_CONCURRENCY, REJECTED_RATE
+
+
+class AdmissionTableTest(SimpleTestCase):
+    """ Test the shared token bucket and concurrency table """
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        self.table = AdmissionTable(self.path, slots=8)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_rate_limit(self):
+        """ Ensure a CSP is rejected once its bucket is empty """
+        for _ in range(3):
+            admitted, _reason, _retry = self.table.try_acquire("a", 0.5, 3, 10)
+            self.assertTrue(admitted)
+
+        admitted, reason, retry_after = self.table.try_acquire("a", 0.5, 3, 10)
+        self.assertFalse(admitted)
+        self.assertEqual(reason, REJECTED_RATE)
+        self.assertGreater(retry_after, 1)
+
+    def test_concurrency_limit(self):
+        """ Ensure a CSP is capped on concurrent requests independently of others """
+        self.assertTrue(self.table.try_acquire("a", 100, 100, 1)[0])
+        admitted, reason, _retry = self.table.try_acquire("a", 100, 100, 1)
+        self.assertFalse(admitted)
+        self.assertEqual(reason, REJECTED_CONCURRENCY)
+        self.assertTrue(self.table.try_acquire("b", 100, 100, 1)[0])
+
+        self.table.release("a")
+        self.assertTrue(self.table.try_acquire("a", 100, 100, 1)[0])
+
+    def test_shared_between_handles(self):
+        """ Ensure separate handles on the same file share state """
+        other = AdmissionTable(self.path, slots=8)
+        self.table.try_acquire("a", 100, 100, 1)
+
+        self.assertFalse(other.try_acquire("a", 100, 100, 1)[0])
+        self.assertEqual(other.stats()[0]["in_flight"], 1)
+
+    def test_killed_worker(self):
+        """ Ensure slots held by a killed worker are reclaimed """
+
+        def acquire_and_die():
+            AdmissionTable(self.path, slots=8).try_acquire("a", 100, 100, 1)
+            os._exit(0)  # exit without releasing, as if SIGKILLed
+
+        child = multiprocessing.get_context("fork").Process(target=acquire_and_die)
+        child.start()
+        child.join()
+
+        self.assertEqual(self.table.stats()[0]["in_flight"], 1)
+        self.assertTrue(self.table.try_acquire("a", 100, 100, 1)[0])
+        self.assertEqual(self.table.stats()[0]["in_flight"], 1)
+
+    def test_release_process(self):
+        """ Ensure a new process drops counts left under its pid """
+        self.table.try_acquire("a", 100, 100, 1)
+        self.table.release_process(os.getpid())
+
+        self.assertEqual(self.table.stats()[0]["in_flight"], 0)
+        self.assertTrue(self.table.try_acquire("a", 100, 100, 1)[0])
+
+    def test_full_table(self):
+        """ Ensure CSPs that do not fit in the table are admitted """
+        for index in range(8):
+            self.table.try_acquire(str(index), 100, 100, 1)
+
+        self.assertTrue(self.table.try_acquire("extra", 100, 100, 0)[0])
+
+
+class AdmissionControlMiddlewareTest(SimpleTestCase):
+    """ Test 429 responses from the admission control middleware """
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+        admission._table = None
+
+    def tearDown(self):
+        admission._table = None
+        os.remove(self.path)
+
+    def test_throttled(self):
+        """ Ensure requests over the limit are rejected with Retry-After """
+        url = reverse("locations", args=[00000])
+        with override_settings(
+            ADMISSION_STATE_FILE=self.path, ADMISSION_RATE=0.1, ADMISSION_BURST=1
+        ):
+            first = self.client.get(url, HTTP_X_CONSUMER_CUSTOM_ID="consumera")
+            second = self.client.get(url, HTTP_X_CONSUMER_CUSTOM_ID="consumera")
+            other = self.client.get(url, HTTP_X_CONSUMER_CUSTOM_ID="consumerb")
+            stats_output = StringIO()
+            call_command("admission_stats", stdout=stats_output)
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(second["Retry-After"], "10")
+        self.assertEqual(other.status_code, status.HTTP_200_OK)
+        self.assertIn("consumera", stats_output.getvalue())
@@ -0,0 +1,112 @@
+""" Test negotiated response compression """
+import gzip
+import json
+from io import StringIO
+from unittest import skipUnless
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from idemia import compression
+from idemia.compression import negotiate
+
+
+class NegotiateTest(SimpleTestCase):
+    """ Test choosing an encoding from Accept-Encoding """
+
+    def test_quality_values(self):
+        """ Ensure the highest quality encoding wins and q=0 excludes one """
+        self.assertEqual(negotiate("gzip"), "gzip")
+        self.assertEqual(negotiate("gzip;q=1.0, identity; q=0.5"), "gzip")
+        self.assertIsNone(negotiate("gzip;q=0"))
+        self.assertIsNone(negotiate("identity"))
+        self.assertIsNone(negotiate(""))
+
+    def test_wildcard(self):
+        """ Ensure * applies only to encodings not listed explicitly """
+        self.assertEqual(negotiate("*;q=0.1, gzip;q=0.5"), "gzip")
+        self.assertIsNone(negotiate("*;q=0"))
+        self.assertEqual(negotiate("*"), next(iter(compression.CODECS)))
+
+    @skipUnless(compression.brotli, "brotli is not installed")
+    def test_server_preference(self):
+        """ Ensure brotli is preferred when accepted equally with gzip """
+        self.assertEqual(negotiate("gzip, deflate, br"), "br")
+        self.assertEqual(negotiate("gzip, br;q=0.5"), "gzip")
+
+
+@override_settings(COMPRESSION_MIN_SIZE=200)
+class CompressionMiddlewareTest(SimpleTestCase):
+    """ Test compressing API responses """
+
+    def setUp(self):
+        compression.cache.clear()
+        self.url = reverse("locations", args=["20166"])
+
+    def test_gzip(self):
+        """ Ensure a large JSON response is gzipped and varies on Accept-Encoding """
+        plain = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        self.assertEqual(
+            json.loads(gzip.decompress(response.content)), json.loads(plain.content)
+        )
+
+    @skipUnless(compression.brotli, "brotli is not installed")
+    def test_brotli(self):
+        """ Ensure brotli is used when the client accepts it """
+        plain = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, br")
+
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(compression.brotli.decompress(response.content), plain.content)
+
+    def test_uncompressed(self):
+        """ Ensure no encoding is applied without Accept-Encoding or below the minimum """
+        response = self.client.get(self.url)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+        with self.settings(COMPRESSION_MIN_SIZE=100000):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_cached(self):
+        """ Ensure repeated cacheable responses are compressed once """
+        first = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        second = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual(first.content, second.content)
+        self.assertEqual((compression.cache.misses, compression.cache.hits), (1, 1))
+
+        with self.settings(COMPRESSION_CACHE_PATHS=[]):
+            self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual((compression.cache.misses, compression.cache.hits), (1, 1))
+
+    def test_cache_bound(self):
+        """ Ensure the cache evicts least recently used entries to fit its size """
+        cache = compression.CompressionCache(max_bytes=10)
+        cache.set("a", b"12345")
+        cache.set("b", b"12345")
+        cache.get("a")
+        cache.set("c", b"12345")
+
+        self.assertEqual(cache.size, 10)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"12345")
+
+    def test_benchmark(self):
+        """ Ensure the benchmark reports every level of each encoding """
+        output = StringIO()
+        call_command(
+            "benchmark_compression",
+            self.url,
+            encodings=["gzip"],
+            repeats=1,
+            stdout=output,
+        )
+        self.assertEqual(output.getvalue().count("\n  gzip "), 9)
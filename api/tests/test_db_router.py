@@ -0,0 +1,142 @@
+""" Test routing of database reads to read replicas """
+import time
+from unittest import mock
+from django.db import connection
+from django.db.utils import OperationalError
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from idemia import db_router
+from idemia.db_router import (
+    PrimaryPinMiddleware,
+    PrimaryReplicaRouter,
+    replica_fallback,
+)
+from ..models import EnrollmentRecord
+
+
+def capture_pin(request) -> HttpResponse:
+    """ Stand-in view that reports whether reads were pinned to the primary """
+    response = HttpResponse()
+    response.pinned = db_router.use_primary_var.get()
+    return response
+
+
+@override_settings(DATABASE_REPLICAS=["replica_0"])
+class PrimaryReplicaRouterTest(SimpleTestCase):
+    """ Test the choice of database for reads and writes """
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        db_router._replica_down_until.clear()
+
+    @mock.patch("idemia.db_router.connections")
+    def test_read_from_replica(self, _mock_connections):
+        """ Ensure unpinned reads go to a replica """
+        self.assertEqual(self.router.db_for_read(EnrollmentRecord), "replica_0")
+
+    def test_write_to_primary(self):
+        """ Ensure writes always go to the primary """
+        self.assertEqual(self.router.db_for_write(EnrollmentRecord), "default")
+
+    @mock.patch("idemia.db_router.connections")
+    def test_pinned_read(self, _mock_connections):
+        """ Ensure pinned reads go to the primary """
+        token = db_router.use_primary_var.set(True)
+        try:
+            self.assertEqual(self.router.db_for_read(EnrollmentRecord), "default")
+        finally:
+            db_router.use_primary_var.reset(token)
+
+    @mock.patch("idemia.db_router.connections")
+    def test_unavailable_replica(self, mock_connections):
+        """ Ensure reads fall back to the primary and skip a failed replica """
+        replica = mock_connections.__getitem__.return_value
+        replica.ensure_connection.side_effect = OperationalError("down")
+
+        self.assertEqual(self.router.db_for_read(EnrollmentRecord), "default")
+        self.assertEqual(self.router.db_for_read(EnrollmentRecord), "default")
+        self.assertEqual(replica.ensure_connection.call_count, 1)
+
+
+@override_settings(DATABASE_REPLICAS=["replica_0"])
+@mock.patch("idemia.db_router.connections")
+class PrimaryPinMiddlewareTest(SimpleTestCase):
+    """ Test pinning of requests to the primary database """
+
+    def setUp(self):
+        self.factory = RequestFactory(HTTP_X_CONSUMER_CUSTOM_ID="consumera")
+        self.middleware = PrimaryPinMiddleware(capture_pin)
+
+    def test_read_not_pinned(self, _mock_connections):
+        """ Ensure a read with no recent writes is not pinned """
+        response = self.middleware(self.factory.get("/"))
+        self.assertFalse(response.pinned)
+        self.assertFalse(response.has_header("X-Last-Write"))
+
+    def test_read_after_write_pinned(self, _mock_connections):
+        """ Ensure reads sending back a write's X-Last-Write header are pinned """
+        write_response = self.middleware(self.factory.post("/"))
+        read_response = self.middleware(
+            self.factory.get("/", HTTP_X_LAST_WRITE=write_response["X-Last-Write"])
+        )
+
+        self.assertTrue(write_response.pinned)
+        self.assertTrue(read_response.pinned)
+
+    def test_no_primary_queries(self, _mock_connections):
+        """ Ensure choosing where a read goes does not query the primary """
+        response = self.client.get(
+            reverse("locations", args=["20166"]),
+            HTTP_X_CONSUMER_CUSTOM_ID="consumera",
+            HTTP_X_LAST_WRITE="%.3f" % time.time(),
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_stale_write_not_pinned(self, _mock_connections):
+        """ Ensure old or invalid write times do not pin reads """
+        with self.settings(DATABASE_REPLICA_LAG_WINDOW=5):
+            for last_write in [
+                "%.3f" % (time.time() - 6),
+                "%.3f" % (time.time() + 6),
+                "x",
+            ]:
+                response = self.middleware(
+                    self.factory.get("/", HTTP_X_LAST_WRITE=last_write)
+                )
+                self.assertFalse(response.pinned, last_write)
+
+
+class ReplicaFallbackTest(TestCase):
+    """ Test retrying queries on the primary when a replica fails mid-request """
+
+    def setUp(self):
+        db_router._replica_down_until.clear()
+        self.record = EnrollmentRecord.objects.create(
+            record_csp_id="consumera",
+            record_csp_uuid="c56a4180-65aa-42ec-a945-5fd21dec0538",
+            record_idemia_ueid="ABCDEFGHIJ",
+        )
+
+    def test_replica_fails_mid_request(self):
+        """ Ensure a failed replica query is answered by the primary """
+        failures = []
+
+        def fail_once(execute, sql, params, many, context):
+            """ Stand-in for a replica connection that drops after opening """
+            if not failures:
+                failures.append(sql)
+                raise OperationalError("server closed the connection unexpectedly")
+            return execute(sql, params, many, context)
+
+        # The default connection stands in for a replica that is already open
+        with connection.execute_wrapper(replica_fallback), connection.execute_wrapper(
+            fail_once
+        ):
+            record = EnrollmentRecord.objects.get(pk=self.record.pk)
+
+        self.assertEqual(record, self.record)
+        self.assertEqual(len(failures), 1)
+        self.assertIn(connection.alias, db_router._replica_down_until)
+        self.assertFalse(db_router.replica_available(connection.alias))
@@ -1,7 +1,13 @@
 """ Test the location functionality of the idemia microservice """
+import os
+import shutil
+import tempfile
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
+from api import locations
+from api.locations import write_location_data
 
 
 class LocationsTest(APITestCase):
@@ -30,3 +36,113 @@ class LocationsTest(APITestCase):
             "geocode",
         ]
         self.assertEqual(list(location_data.keys()), data_keys)
+
+
+def generate_reference_data(title) -> tuple:
+    """ Helper method for generating ZIP code and site reference data """
+    zips = [("20166", 38.95, -77.44), ("22182", 38.92, -77.23), ("90210", 34.1, -118.4)]
+    sites = [
+        {
+            "title": "%s %d" % (title, index),
+            "address": "1 Saarinen Circle",
+            "address2": "",
+            "city": "Sterling",
+            "state": "VA",
+            "postalCode": "20166-7547",
+            "hours": "Monday-Friday: 8:00 AM - 4:00 PM",
+            "phone": "855-787-2227",
+            "latitude": latitude,
+            "longitude": -77.4,
+        }
+        for index, latitude in enumerate([38.94, 34.0, 39.2])
+    ]
+    return zips, sites
+
+
+class LocationDataTest(APITestCase):
+    """ Test /locations backed by a memory-mapped location data file """
+
+    site_keys = [
+        "title",
+        "address",
+        "address2",
+        "city",
+        "state",
+        "postalCode",
+        "distance",
+        "hours",
+        "phone",
+        "geocode",
+    ]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "locations.bin")
+        zips, sites = generate_reference_data("Site")
+        write_location_data(self.path, zips, sites, data_version=1)
+        locations._location_data = None
+
+    def tearDown(self):
+        locations._location_data = None
+        shutil.rmtree(self.directory)
+
+    def test_nearest_sites(self):
+        """ Ensure sites are returned nearest first, in the API format """
+        with override_settings(LOCATIONS_DATA_FILE=self.path, LOCATIONS_RESULT_LIMIT=2):
+            response = self.client.get(reverse("locations", args=["20166-1234"]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [site["title"] for site in response.data], ["Site 0", "Site 2"]
+        )
+        self.assertEqual(list(response.data[0].keys()), self.site_keys)
+        self.assertLess(float(response.data[0]["distance"]), 10)
+
+    def test_unknown_and_invalid_zipcodes(self):
+        """ Ensure unknown ZIP codes have no sites and invalid ones are rejected """
+        with override_settings(LOCATIONS_DATA_FILE=self.path):
+            unknown = self.client.get(reverse("locations", args=["00000"]))
+            invalid = self.client.get(reverse("locations", args=["abcde"]))
+
+        self.assertEqual(unknown.data, [])
+        self.assertEqual(invalid.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_hot_reload(self):
+        """ Ensure a replaced data file is loaded without a restart """
+        with override_settings(
+            LOCATIONS_DATA_FILE=self.path, LOCATIONS_RELOAD_INTERVAL=0
+        ):
+            first = locations.get_location_data()
+            zips, sites = generate_reference_data("Rebuilt")
+            write_location_data(self.path, zips, sites, data_version=2)
+            second = locations.get_location_data()
+
+        self.assertEqual(first.version, 1)
+        self.assertEqual(second.version, 2)
+        self.assertEqual(second.nearest("20166", 1)[0]["title"], "Rebuilt 0")
+
+    def test_failed_reload(self):
+        """ Ensure the last good data is served when the file goes bad """
+        with override_settings(
+            LOCATIONS_DATA_FILE=self.path, LOCATIONS_RELOAD_INTERVAL=0
+        ):
+            first = locations.get_location_data()
+            # Data files are replaced, never rewritten in place, as they are mapped
+            with open(self.path + ".new", "wb") as data_file:
+                data_file.write(b"corrupt")
+            os.replace(self.path + ".new", self.path)
+            corrupt = self.client.get(reverse("locations", args=["20166"]))
+            os.remove(self.path)
+            missing = self.client.get(reverse("locations", args=["20166"]))
+
+        self.assertIs(locations.get_location_data(), first)
+        self.assertEqual(corrupt.status_code, status.HTTP_200_OK)
+        self.assertEqual(missing.status_code, status.HTTP_200_OK)
+        self.assertEqual(missing.data[0]["title"], "Site 0")
+
+    def test_never_loaded(self):
+        """ Ensure a missing file with no data loaded is a 503, not a 500 """
+        with override_settings(LOCATIONS_DATA_FILE=self.path + ".missing"):
+            response = self.client.get(reverse("locations", args=["20166"]))
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
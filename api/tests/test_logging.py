@@ -0,0 +1,151 @@
+""" Test the queued, structured logging pipeline """
+import io
+import json
+import logging
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework import status
+from idemia.log import (
+    JSONFormatter,
+    QueueStreamHandler,
+    RequestContextFilter,
+    request_id_var,
+    csp_id_var,
+)
+
+
+class RecordCollector(logging.Handler):
+    """ Helper handler that keeps the records it receives """
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.addFilter(RequestContextFilter())
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def build_logger(handler) -> logging.Logger:
+    """ Helper method for creating an isolated logger using the given handler """
+    logger = logging.getLogger("test_logging.%d" % id(handler))
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+class QueueStreamHandlerTest(SimpleTestCase):
+    """ Test the QueueStreamHandler and JSONFormatter """
+
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = QueueStreamHandler(maxsize=100, stream=self.stream)
+        self.handler.setFormatter(JSONFormatter())
+        self.handler.addFilter(RequestContextFilter())
+        self.logger = build_logger(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+    def read_entries(self) -> list:
+        """ Flush the listener thread and return the parsed log lines """
+        self.handler.stop()
+        return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+    def test_json_output(self):
+        """ Ensure records are written as JSON with their context attached """
+        request_token = request_id_var.set("abc123")
+        csp_token = csp_id_var.set("consumera")
+        try:
+            self.logger.info("Record %s", "Created")
+        finally:
+            request_id_var.reset(request_token)
+            csp_id_var.reset(csp_token)
+
+        entries = self.read_entries()
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0]["message"], "Record Created")
+        self.assertEqual(entries[0]["level"], "INFO")
+        self.assertEqual(entries[0]["request_id"], "abc123")
+        self.assertEqual(entries[0]["csp_id"], "consumera")
+
+    def test_exception_output(self):
+        """ Ensure tracebacks are rendered before the record is queued """
+        try:
+            raise ValueError("bad value")
+        except ValueError:
+            self.logger.exception("Failure")
+
+        entries = self.read_entries()
+        self.assertIn("ValueError: bad value", entries[0]["exc_info"])
+
+    def test_record_unchanged(self):
+        """ Ensure handlers after this one still see the original record """
+        collector = RecordCollector()
+        self.logger.addHandler(collector)
+        try:
+            raise ValueError("bad value")
+        except ValueError:
+            self.logger.exception("Failure %s", "here")
+
+        record = collector.records[0]
+        self.assertEqual((record.msg, record.args), ("Failure %s", ("here",)))
+        self.assertIs(record.exc_info[0], ValueError)
+        self.assertEqual(self.read_entries()[0]["message"], "Failure here")
+
+    def test_full_queue_drops(self):
+        """ Ensure a full queue drops records instead of blocking """
+        self.handler.stop()
+        for _ in range(self.handler.queue.maxsize + 5):
+            self.logger.info("filler")
+
+        self.assertEqual(self.handler.dropped, 5)
+
+
+class RequestContextMiddlewareTest(SimpleTestCase):
+    """ Test request correlation IDs on API responses """
+
+    def test_generated_request_id(self):
+        """ Ensure a request ID is generated when none is supplied """
+        response = self.client.get(reverse("locations", args=[00000]))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["X-Request-ID"])
+
+    def test_forwarded_request_id(self):
+        """ Ensure an incoming request ID is echoed back """
+        response = self.client.get(
+            reverse("locations", args=[00000]), HTTP_X_REQUEST_ID="gateway-id"
+        )
+
+        self.assertEqual(response["X-Request-ID"], "gateway-id")
+
+
+class RequestLogContextTest(TestCase):
+    """ Test the IDs on lines Django logs after the middleware returns """
+
+    def setUp(self):
+        self.collector = RecordCollector()
+        self.logger = logging.getLogger("django.request")
+        self.logger.addHandler(self.collector)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.collector)
+
+    def test_not_found_ids(self):
+        """ Ensure the django.request warning for a 404 carries both IDs """
+        url = reverse(
+            "enrollment-record", args=["c56a4180-65aa-42ec-a945-5fd21dec0538"]
+        )
+        response = self.client.get(
+            url, HTTP_X_REQUEST_ID="gateway-id", HTTP_X_CONSUMER_CUSTOM_ID="consumera"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        record = self.collector.records[-1]
+        self.assertTrue(record.getMessage().startswith("Not Found"))
+        self.assertEqual(record.request_id, "gateway-id")
+        self.assertEqual(record.csp_id, "consumera")
+        self.assertIsNone(request_id_var.get())
@@ -0,0 +1,151 @@
+""" Test monthly partitioning of enrollment records """
+import datetime
+import uuid
+from unittest import skipUnless
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase
+from api.partitioning import (
+    add_months,
+    convert_table,
+    create_partition,
+    default_partition_months,
+    delete_expired_keys,
+    expire_partitions,
+    is_partitioned,
+    list_partitions,
+    month_start,
+    partition_name,
+)
+from ..models import EnrollmentRecord
+
+
+def create_record(csp_id="consumera", csp_uuid=None) -> EnrollmentRecord:
+    """ Helper method for creating an EnrollmentRecord directly """
+    return EnrollmentRecord.objects.create(
+        record_csp_id=csp_id,
+        record_csp_uuid=csp_uuid or uuid.uuid4(),
+        record_idemia_ueid="ABCDEFGHIJ",
+    )
+
+
+class PartitionMonthTest(SimpleTestCase):
+    """ Test the partition month helpers """
+
+    def test_add_months(self):
+        """ Ensure month arithmetic crosses year boundaries """
+        self.assertEqual(
+            add_months(datetime.date(2021, 11, 1), 3), datetime.date(2022, 2, 1)
+        )
+        self.assertEqual(
+            add_months(datetime.date(2021, 1, 1), -1), datetime.date(2020, 12, 1)
+        )
+
+    def test_partition_name(self):
+        """ Ensure partitions are named by year and month """
+        month = month_start(datetime.date(2021, 3, 17))
+        self.assertEqual(partition_name(month), "api_enrollmentrecord_p202103")
+
+
+@skipUnless(connection.vendor == "postgresql", "Partitioning requires PostgreSQL")
+class PartitioningTest(TestCase):
+    """ Test converting and expiring enrollment record partitions """
+
+    def setUp(self):
+        self.existing = create_record()
+        with connection.cursor() as cursor:
+            convert_table(cursor, months_ahead=2)
+
+    def test_convert(self):
+        """ Ensure existing records are kept and future partitions created """
+        this_month = month_start(datetime.date.today())
+        with connection.cursor() as cursor:
+            self.assertTrue(is_partitioned(cursor))
+            names = [name for _month, name in list_partitions(cursor)]
+
+        self.assertIn(partition_name(this_month), names)
+        self.assertIn(partition_name(add_months(this_month, 2)), names)
+        self.assertEqual(
+            EnrollmentRecord.objects.get(
+                record_csp_id="consumera", record_csp_uuid=self.existing.record_csp_uuid
+            ).pk,
+            self.existing.pk,
+        )
+        self.assertGreater(create_record().pk, self.existing.pk)
+
+    def test_unique_across_partitions(self):
+        """ Ensure CSP UUIDs stay unique per CSP """
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            create_record(csp_uuid=self.existing.record_csp_uuid)
+
+        create_record(csp_id="consumerb", csp_uuid=self.existing.record_csp_uuid)
+
+    def test_create_with_default_rows(self):
+        """ Ensure creating a month moves its rows out of the default partition """
+        month = add_months(month_start(datetime.date.today()), 6)
+        record = create_record()
+        EnrollmentRecord.objects.filter(pk=record.pk).update(
+            creation_date=datetime.datetime.combine(
+                month, datetime.time(12), tzinfo=datetime.timezone.utc
+            )
+        )
+        with connection.cursor() as cursor:
+            self.assertEqual(default_partition_months(cursor), [month])
+            create_partition(cursor, month)
+            self.assertEqual(default_partition_months(cursor), [])
+            cursor.execute(
+                "SELECT tableoid::regclass::text FROM api_enrollmentrecord "
+                "WHERE id = %s",
+                [record.pk],
+            )
+            self.assertEqual(cursor.fetchone()[0], partition_name(month))
+
+        # The record keeps its uniqueness key and can still change
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            create_record(csp_uuid=record.record_csp_uuid)
+        EnrollmentRecord.objects.filter(pk=record.pk).delete()
+        create_record(csp_uuid=record.record_csp_uuid)
+
+    def test_expire(self):
+        """ Ensure expired months are dropped along with their keys """
+        old_month = add_months(month_start(datetime.date.today()), -13)
+        old_date = datetime.datetime.combine(
+            old_month, datetime.time(), tzinfo=datetime.timezone.utc
+        )
+        with connection.cursor() as cursor:
+            create_partition(cursor, old_month)
+        old_record = create_record()
+        EnrollmentRecord.objects.filter(pk=old_record.pk).update(creation_date=old_date)
+
+        with connection.cursor() as cursor:
+            expired = expire_partitions(cursor, retention_months=12, drop=True)
+            # Keys outlive the partition until they are deleted in batches
+            with self.assertRaises(IntegrityError), transaction.atomic():
+                create_record(csp_uuid=old_record.record_csp_uuid)
+            deleted = delete_expired_keys(cursor, retention_months=12, batch_size=1)
+
+        self.assertEqual(expired, [partition_name(old_month)])
+        self.assertEqual(deleted, 1)
+        self.assertFalse(EnrollmentRecord.objects.filter(pk=old_record.pk).exists())
+        self.assertTrue(EnrollmentRecord.objects.filter(pk=self.existing.pk).exists())
+        create_record(csp_uuid=old_record.record_csp_uuid)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            create_record(csp_uuid=self.existing.record_csp_uuid)
+
+    def test_delete_expired_keys_keeps_live_records(self):
+        """ Ensure keys of records that still exist are never deleted """
+        old_date = datetime.datetime.combine(
+            add_months(month_start(datetime.date.today()), -13),
+            datetime.time(),
+            tzinfo=datetime.timezone.utc,
+        )
+        # An old key whose record is still in a live partition
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE api_enrollmentrecord_key SET creation_date = %s",
+                [old_date],
+            )
+            deleted = delete_expired_keys(cursor, retention_months=12, batch_size=10)
+
+        self.assertEqual(deleted, 0)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            create_record(csp_uuid=self.existing.record_csp_uuid)
@@ -0,0 +1,112 @@
+""" Test on-demand request profiling """
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.urls import reverse
+from django.test import TestCase, override_settings
+from rest_framework import status
+from idemia.profiling import list_profiles, load_profile, make_token, write_profile
+
+
+class ProfilingTest(TestCase):
+    """ Test the profiling middleware and profiles management command """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            PROFILING_ENABLED=True,
+            PROFILING_DIR=self.directory,
+            PROFILING_INTERVAL=0.001,
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def get_enrollment(self, **headers):
+        """ Helper method for requesting a missing enrollment record """
+        url = reverse(
+            "enrollment-record", args=["c56a4180-65aa-42ec-a945-5fd21dec0538"]
+        )
+        return self.client.get(url, HTTP_X_CONSUMER_CUSTOM_ID="consumera", **headers)
+
+    def test_signed_header(self):
+        """ Ensure requests with a valid token are profiled with their queries """
+        response = self.get_enrollment(HTTP_X_PROFILE_TOKEN=make_token())
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        profiles = list_profiles(self.directory)
+        self.assertEqual(len(profiles), 1)
+        profile = load_profile(profiles[0])
+        self.assertEqual(profile["csp_id"], "consumera")
+        self.assertEqual(profile["status"], status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(profile["queries"]), 1)
+        self.assertIn("api_enrollmentrecord", profile["queries"][0]["sql"])
+
+    def test_unwritable_directory(self):
+        """ Ensure a profile that cannot be saved does not fail the request """
+        # A file where the directory should be cannot hold profiles
+        blocked = os.path.join(self.directory, "blocked")
+        with open(blocked, "w"):
+            pass
+        with self.settings(PROFILING_DIR=blocked):
+            with self.assertLogs(level="ERROR") as logs:
+                response = self.get_enrollment(HTTP_X_PROFILE_TOKEN=make_token())
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIn("Cannot save request profile", logs.output[0])
+
+    def test_unsigned_requests(self):
+        """ Ensure requests without a valid token are not profiled """
+        self.get_enrollment()
+        self.get_enrollment(HTTP_X_PROFILE_TOKEN="profile:forged:token")
+
+        self.assertEqual(list_profiles(self.directory), [])
+
+    def test_ring_buffer(self):
+        """ Ensure only the newest profiles are kept """
+        for index in range(5):
+            write_profile({"request_id": str(index)}, self.directory, 3)
+
+        profiles = list_profiles(self.directory)
+        self.assertEqual(len(profiles), 3)
+        self.assertEqual(load_profile(profiles[0])["request_id"], "2")
+
+    def test_collapse(self):
+        """ Ensure profiles are merged into collapsed stacks """
+        base = {"csp_id": "consumera", "path": "/", "interval": 0.001, "queries": []}
+        write_profile(
+            {**base, "request_id": "1", "stacks": {"a;b": 2}}, self.directory, 5
+        )
+        write_profile(
+            {**base, "request_id": "2", "stacks": {"a;b": 1}}, self.directory, 5
+        )
+
+        output = StringIO()
+        call_command("profiles", "collapse", stdout=output)
+
+        self.assertEqual(output.getvalue(), "a;b 3\n")
+
+    def test_pruned_while_listing(self):
+        """ Ensure profiles removed after they were listed are skipped """
+        base = {"csp_id": "consumera", "path": "/", "interval": 0.001, "queries": []}
+        for request_id in "12":
+            write_profile(
+                {**base, "request_id": request_id, "stacks": {"a;b": 1}},
+                self.directory,
+                5,
+            )
+        profiles = list_profiles(self.directory)
+        os.remove(profiles[0])
+
+        output = StringIO()
+        with mock.patch(
+            "api.management.commands.profiles.list_profiles", return_value=profiles
+        ):
+            call_command("profiles", "collapse", stdout=output)
+
+        self.assertEqual(output.getvalue(), "a;b 1\n")
@@ -0,0 +1,169 @@
+"""
+Scale tests for the enrollment record queries made by the API.
+
+These load SCALE_TEST_RECORDS synthetic records with the generate_enrollments
+command, then run the queries the API makes for each operation, recording the
+EXPLAIN ANALYZE plan of every statement and the operation's latency, and fail
+if any plan sequentially scans a large table. Operations run in savepoints
+that are rolled back, so writes do not change the data between runs. Set SCALE_TEST_REPORT
+to a file path to save the plans and timings as JSON. They only run against
+PostgreSQL, e.g.:
+
+    SCALE_TEST_RECORDS=2000000 python manage.py test api.tests.test_scale
+"""
+import copy
+import json
+import os
+import time
+import uuid
+from io import StringIO
+from unittest import skipUnless
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from ..models import EnrollmentRecord
+
+SCALE_TEST_RECORDS = int(os.environ.get("SCALE_TEST_RECORDS", "0"))
+# Fail if a query's p95 latency in milliseconds exceeds this, when set
+SCALE_TEST_MAX_MS = float(os.environ.get("SCALE_TEST_MAX_MS", "0"))
+# Sequential scans of relations estimated to hold fewer rows are allowed
+SEQ_SCAN_ROW_LIMIT = 10000
+REPEATS = 20
+
+
+def plan_nodes(node):
+    """ Yield a plan node and all of its descendants """
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+@skipUnless(
+    connection.vendor == "postgresql" and SCALE_TEST_RECORDS,
+    "Set SCALE_TEST_RECORDS and use PostgreSQL to run scale tests",
+)
+class EnrollmentScaleTest(TestCase):
+    """ Check query plans and latency against a large enrollment table """
+
+    report = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            "generate_enrollments",
+            count=SCALE_TEST_RECORDS,
+            csps=50,
+            seed=0,
+            stdout=StringIO(),
+        )
+        cls.record = EnrollmentRecord.objects.filter(record_csp_id="csp-0001")[0]
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        report_path = os.environ.get("SCALE_TEST_REPORT")
+        if report_path:
+            with open(report_path, "w") as report_file:
+                json.dump(cls.report, report_file, indent=2)
+
+    def explain(self, sql) -> dict:
+        """ Run EXPLAIN ANALYZE on a captured statement and return the JSON plan """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql)
+            plan = cursor.fetchone()[0]
+            transaction.set_rollback(True)
+        return (json.loads(plan) if isinstance(plan, str) else plan)[0]
+
+    def large_relation(self, name) -> bool:
+        """ Check whether a relation's estimated row count is over the limit """
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [name])
+            row = cursor.fetchone()
+        return row is not None and row[0] >= SEQ_SCAN_ROW_LIMIT
+
+    @staticmethod
+    def run_rolled_back(operation) -> tuple:
+        """ Run operation in a rolled back savepoint; return its queries and ms """
+        with transaction.atomic(), CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            operation()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            transaction.set_rollback(True)
+        return [query["sql"] for query in queries], elapsed_ms
+
+    def check_operation(self, shape, operation):
+        """ Record an operation's plans and latency, and fail on large seq scans """
+        statements, _elapsed_ms = self.run_rolled_back(operation)
+        plans = [self.explain(sql) for sql in statements]
+        timings = sorted(self.run_rolled_back(operation)[1] for _ in range(REPEATS))
+        p95_ms = timings[int(len(timings) * 0.95) - 1]
+        self.report[shape] = {
+            "records": SCALE_TEST_RECORDS,
+            "median_ms": timings[len(timings) // 2],
+            "p95_ms": p95_ms,
+            "statements": [
+                {
+                    "sql": sql,
+                    "execution_ms": plan["Execution Time"],
+                    "plan": plan["Plan"],
+                }
+                for sql, plan in zip(statements, plans)
+            ],
+        }
+
+        self.assertTrue(statements, "%s made no queries" % shape)
+        seq_scans = [
+            node["Relation Name"]
+            for plan in plans
+            for node in plan_nodes(plan["Plan"])
+            if node["Node Type"] == "Seq Scan"
+            and self.large_relation(node["Relation Name"])
+        ]
+        self.assertEqual(seq_scans, [], "%s plan regressed to a seq scan" % shape)
+        if SCALE_TEST_MAX_MS:
+            self.assertLessEqual(p95_ms, SCALE_TEST_MAX_MS, shape)
+
+    def retrieve(self, csp_uuid):
+        """ The EnrollmentRecordDetail lookup, as made by get_object_or_404 """
+        try:
+            return EnrollmentRecord.objects.filter(
+                record_csp_id=self.record.record_csp_id
+            ).get(record_csp_uuid=csp_uuid)
+        except EnrollmentRecord.DoesNotExist:
+            return None
+
+    def test_enrollment_detail(self):
+        """ EnrollmentRecordDetail lookup of an existing record """
+        self.check_operation(
+            "enrollment_detail", lambda: self.retrieve(self.record.record_csp_uuid)
+        )
+
+    def test_enrollment_detail_missing(self):
+        """ EnrollmentRecordDetail lookup of a record that does not exist """
+        self.check_operation(
+            "enrollment_detail_missing", lambda: self.retrieve(uuid.uuid4())
+        )
+
+    def test_create(self):
+        """
+        EnrollmentRecordCreate insert. The serializer has no uniqueness
+        validator, since record_csp_id is read-only, so (record_csp_uuid,
+        record_csp_id) uniqueness is checked by the database during the insert.
+        """
+        self.check_operation(
+            "create",
+            lambda: EnrollmentRecord.objects.create(
+                record_csp_id=self.record.record_csp_id,
+                record_csp_uuid=uuid.uuid4(),
+                record_idemia_ueid="ABCDEFGHIJ",
+            ),
+        )
+
+    def test_update_by_pk(self):
+        """ Save of a retrieved record by EnrollmentRecordDetail updates """
+        self.check_operation("update_by_pk", lambda: copy.copy(self.record).save())
+
+    def test_delete_by_pk(self):
+        """ Delete of a retrieved record by EnrollmentRecordDetail deletes """
+        self.check_operation("delete_by_pk", lambda: copy.copy(self.record).delete())
@@ -7,9 +7,10 @@ from rest_framework.generics import (
     RetrieveUpdateDestroyAPIView,
 )
 from rest_framework import status
-from rest_framework.exceptions import APIException
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
+from .locations import LocationDataError, get_location_data, parse_zipcode
 from .models import EnrollmentRecord, EnrollmentStatus
 from .serializers import EnrollmentRecordSerializer
 
@@ -27,6 +28,14 @@ class TransactionServiceUnavailable(APIException):
     default_code = "service_unavailable"
 
 
+class LocationDataUnavailable(APIException):
+    """ Thrown when no location data file has been loaded """
+
+    status_code = 503
+    default_detail = "Location data temporarily unavailable, try again later."
+    default_code = "service_unavailable"
+
+
 def log_transaction():
     """
     Log a transaction to the transaction logging microservice.
@@ -115,6 +124,16 @@ def location_view(_request, zipcode):
     """ Exposes the /locations idemia UEP endpoint """
     logging.info("Calling Idemia /locations endpoint with zipcode: %s", zipcode)
 
+    if settings.LOCATIONS_DATA_FILE:
+        if parse_zipcode(zipcode) is None:
+            raise ValidationError({"zipcode": "Enter a valid ZIP code."})
+        try:
+            location_data = get_location_data()
+        except LocationDataError as error:
+            logging.error(error)
+            raise LocationDataUnavailable from error
+        return Response(location_data.nearest(zipcode, settings.LOCATIONS_RESULT_LIMIT))
+
     # Dummy location info
     location_list = [
         {
@@ -0,0 +1,286 @@
+"""
+Per-CSP admission control.
+
+Each CSP (identified by the X-Consumer-Custom-ID header) gets a token bucket
+that limits its request rate and a cap on its concurrent requests. State is
+kept in a memory-mapped file so every worker process on an instance shares
+the same limits. Requests over the concurrency cap wait briefly for a slot;
+requests that still cannot be admitted get a 429 with a Retry-After header.
+
+In-flight requests are counted per worker process, so the slots held by a
+worker that was killed mid-request are reclaimed once its pid is gone.
+"""
+import errno
+import fcntl
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from django.conf import settings
+from django.http import JsonResponse
+
+CSP_ID_HEADER = "HTTP_X_CONSUMER_CUSTOM_ID"
+
+# Worker processes that can hold a CSP's in-flight requests at once
+HOLDERS = 16
+# csp_id, tokens, updated, admitted, queued, rejected_rate, rejected_concurrency,
+# then a (pid, in-flight count) pair for each holder
+SLOT = struct.Struct("<64sddqqqq" + "ii" * HOLDERS)
+CSP_ID_SIZE = 64
+HOLDERS_START = 7
+
+REJECTED_RATE = "rate"
+REJECTED_CONCURRENCY = "concurrency"
+
+
+def pid_alive(pid) -> bool:
+    """ Check whether a process exists """
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        return error.errno != errno.ESRCH
+    return True
+
+
+def in_flight(slot) -> int:
+    """ Total in-flight requests across a slot's holders """
+    return sum(slot[HOLDERS_START + 1 :: 2])
+
+
+class AdmissionTable:
+    """
+    Fixed-size, open-addressed table of per-CSP counters in a shared,
+    memory-mapped file. Updates hold an exclusive flock on the file.
+    """
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self.size = SLOT.size * slots
+        self._thread_lock = threading.Lock()
+        self._file = open(path, "a+b")  # pylint: disable=consider-using-with
+        with self._locked():
+            if os.fstat(self._file.fileno()).st_size < self.size:
+                os.ftruncate(self._file.fileno(), self.size)
+        self._map = mmap.mmap(self._file.fileno(), self.size)
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    def _read(self, index) -> list:
+        return list(SLOT.unpack_from(self._map, index * SLOT.size))
+
+    def _write(self, index, values):
+        SLOT.pack_into(self._map, index * SLOT.size, *values)
+
+    def _find(self, csp_id, burst=0.0, now=0.0):
+        """
+        Return the slot index for a CSP, claiming an empty slot (with a full
+        bucket) if it has none. Returns None if the table is full.
+        """
+        key = csp_id.encode()[:CSP_ID_SIZE].ljust(CSP_ID_SIZE, b"\0")
+        start = zlib.crc32(key) % self.slots
+        for offset in range(self.slots):
+            index = (start + offset) % self.slots
+            slot_key = self._map[index * SLOT.size : index * SLOT.size + CSP_ID_SIZE]
+            if slot_key == key:
+                return index
+            if not slot_key.strip(b"\0"):
+                self._write(index, [key, burst, now, 0, 0, 0, 0] + [0] * 2 * HOLDERS)
+                return index
+        return None
+
+    @staticmethod
+    def _reap(slot):
+        """ Drop the in-flight counts of holders whose process has exited """
+        for position in range(HOLDERS_START, len(slot), 2):
+            if slot[position + 1] and not pid_alive(slot[position]):
+                slot[position : position + 2] = [0, 0]
+
+    @staticmethod
+    def _holder(slot, pid):
+        """
+        Return the position of pid's holder entry in a slot, or of a free
+        entry if pid holds nothing. Returns None if no entry is free.
+        """
+        free = None
+        for position in range(HOLDERS_START, len(slot), 2):
+            if slot[position] == pid and slot[position + 1]:
+                return position
+            if free is None and not slot[position + 1]:
+                free = position
+        return free
+
+    def try_acquire(self, csp_id, rate, burst, max_concurrent):
+        """
+        Take a token and a concurrency slot for the CSP. Returns a tuple of
+        (admitted, rejection reason, seconds until a retry may succeed).
+        """
+        now = time.time()
+        pid = os.getpid()
+        with self._locked():
+            index = self._find(csp_id, burst, now)
+            if index is None:
+                return True, None, 0  # fail open rather than reject unknown CSPs
+            slot = self._read(index)
+            tokens = min(burst, slot[1] + max(0.0, now - slot[2]) * rate)
+            slot[1:3] = [tokens, now]
+
+            if in_flight(slot) >= max_concurrent:
+                # Counts left behind by a worker that was killed mid-request
+                self._reap(slot)
+            position = self._holder(slot, pid)
+            if in_flight(slot) >= max_concurrent or position is None:
+                self._write(index, slot)
+                return False, REJECTED_CONCURRENCY, 1
+            if tokens < 1:
+                self._write(index, slot)
+                return False, REJECTED_RATE, (1 - tokens) / rate
+
+            slot[1] = tokens - 1
+            slot[3] += 1
+            slot[position : position + 2] = [pid, slot[position + 1] + 1]
+            self._write(index, slot)
+            return True, None, 0
+
+    def release(self, csp_id):
+        """ Return a concurrency slot taken by try_acquire """
+        pid = os.getpid()
+        with self._locked():
+            index = self._find(csp_id)
+            if index is None:
+                return
+            slot = self._read(index)
+            position = self._holder(slot, pid)
+            if position is not None and slot[position] == pid:
+                count = slot[position + 1] - 1
+                slot[position : position + 2] = [pid if count else 0, count]
+                self._write(index, slot)
+
+    def release_process(self, pid):
+        """
+        Drop every in-flight count held by pid, such as counts left behind by
+        an earlier process that had the same pid
+        """
+        with self._locked():
+            for index in range(self.slots):
+                slot = self._read(index)
+                for position in range(HOLDERS_START, len(slot), 2):
+                    if slot[position] == pid:
+                        slot[position : position + 2] = [0, 0]
+                self._write(index, slot)
+
+    def record(self, csp_id, queued=False, rejected=None):
+        """ Count a queued request and/or a rejection for the CSP """
+        with self._locked():
+            index = self._find(csp_id)
+            if index is None:
+                return
+            slot = self._read(index)
+            if queued:
+                slot[4] += 1
+            if rejected == REJECTED_RATE:
+                slot[5] += 1
+            elif rejected == REJECTED_CONCURRENCY:
+                slot[6] += 1
+            self._write(index, slot)
+
+    def stats(self) -> list:
+        """ Return the counters for every CSP in the table """
+        with self._locked():
+            slots = [self._read(index) for index in range(self.slots)]
+        return [
+            {
+                "csp_id": slot[0].rstrip(b"\0").decode(errors="replace"),
+                "tokens": slot[1],
+                "in_flight": in_flight(slot),
+                "admitted": slot[3],
+                "queued": slot[4],
+                "rejected_rate": slot[5],
+                "rejected_concurrency": slot[6],
+            }
+            for slot in slots
+            if slot[0].strip(b"\0")
+        ]
+
+
+_table = None
+_table_pid = None
+
+
+def get_admission_table() -> AdmissionTable:
+    """
+    Return this process's handle on the shared table. Handles are reopened
+    after a fork since flock locks are shared by inherited file descriptors.
+    A new process first drops any counts recorded under its pid by a dead
+    process that had the same pid.
+    """
+    global _table, _table_pid  # pylint: disable=global-statement
+    if _table is None or _table_pid != os.getpid():
+        _table = AdmissionTable(settings.ADMISSION_STATE_FILE, settings.ADMISSION_SLOTS)
+        _table_pid = os.getpid()
+        _table.release_process(_table_pid)
+    return _table
+
+
+class AdmissionControlMiddleware:
+    """ Reject requests from CSPs that exceed their rate or concurrency limits """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        csp_id = request.META.get(CSP_ID_HEADER)
+        if not settings.ADMISSION_CONTROL_ENABLED or not csp_id:
+            return self.get_response(request)
+
+        table = get_admission_table()
+        deadline = time.monotonic() + settings.ADMISSION_QUEUE_TIMEOUT
+        queued = False
+        while True:
+            admitted, reason, retry_after = table.try_acquire(
+                csp_id,
+                settings.ADMISSION_RATE,
+                settings.ADMISSION_BURST,
+                settings.ADMISSION_MAX_CONCURRENT,
+            )
+            if admitted:
+                break
+            if reason == REJECTED_RATE or time.monotonic() >= deadline:
+                table.record(csp_id, queued=queued, rejected=reason)
+                logging.warning("Throttled request from %s: %s limit", csp_id, reason)
+                return self.throttled(retry_after)
+            queued = True
+            time.sleep(0.01)
+
+        if queued:
+            table.record(csp_id, queued=True)
+        try:
+            return self.get_response(request)
+        finally:
+            table.release(csp_id)
+
+    @staticmethod
+    def throttled(retry_after) -> JsonResponse:
+        """ Build a 429 response matching rest_framework's Throttled errors """
+        wait = max(1, math.ceil(retry_after))
+        response = JsonResponse(
+            {
+                "detail": "Request was throttled. Expected available in %d seconds."
+                % wait
+            },
+            status=429,
+        )
+        response["Retry-After"] = str(wait)
+        return response
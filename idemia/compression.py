@@ -0,0 +1,192 @@
+"""
+Response compression negotiated by Accept-Encoding.
+
+Supports gzip, plus brotli ("br") and zstd when the brotli and zstandard
+packages are installed. Only responses of at least settings.COMPRESSION_MIN_SIZE
+bytes with a compressible content type are compressed. Compressed bodies of
+GET responses under settings.COMPRESSION_CACHE_PATHS are kept in a small
+per-process LRU cache keyed by a digest of the uncompressed body, so repeated
+location lists and API docs are compressed once.
+"""
+import collections
+import gzip
+import hashlib
+import re
+import threading
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+
+def _gzip(data, level) -> bytes:
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _brotli(data, level) -> bytes:
+    return brotli.compress(data, quality=level)
+
+
+def _zstd(data, level) -> bytes:
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+# Available encodings in order of preference when a client accepts several
+CODECS = collections.OrderedDict()
+if brotli is not None:
+    CODECS["br"] = _brotli
+if zstandard is not None:
+    CODECS["zstd"] = _zstd
+CODECS["gzip"] = _gzip
+
+# Valid levels for each encoding, used by benchmark_compression
+LEVELS = {"br": range(0, 12), "zstd": range(1, 20), "gzip": range(1, 10)}
+
+COMPRESSIBLE_TYPES = {
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/yaml",
+    "application/x-yaml",
+    "application/openapi+json",
+    "image/svg+xml",
+}
+
+ACCEPT_ENCODING_PART = re.compile(r"^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$")
+
+
+def negotiate(accept_encoding):
+    """
+    Pick the preferred available encoding allowed by an Accept-Encoding
+    header, or None if the response should not be compressed.
+    """
+    qualities = {}
+    for part in accept_encoding.lower().split(","):
+        match = ACCEPT_ENCODING_PART.match(part)
+        if match:
+            try:
+                qualities[match.group(1)] = float(match.group(2) or 1)
+            except ValueError:
+                continue
+
+    best = None
+    best_quality = 0.0
+    for encoding in CODECS:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressible(content_type) -> bool:
+    """ Check whether a content type benefits from compression """
+    media_type = content_type.split(";")[0].strip().lower()
+    return (
+        media_type.startswith("text/")
+        or media_type in COMPRESSIBLE_TYPES
+        or media_type.endswith(("+json", "+xml"))
+    )
+
+
+class CompressionCache:
+    """ Thread-safe LRU cache of compressed bodies bounded by total bytes """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _key, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = self.hits = self.misses = 0
+
+
+cache = CompressionCache(max_bytes=8 * 2**20)
+
+
+class CompressionMiddleware:
+    """ Compress large, compressible responses with the client's preferred codec """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        cache.max_bytes = settings.COMPRESSION_CACHE_BYTES
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            response.streaming
+            or response.has_header("Content-Encoding")
+            or response.status_code in (204, 206, 304)
+            or len(response.content) < settings.COMPRESSION_MIN_SIZE
+            or not compressible(response.get("Content-Type", ""))
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = negotiate(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if encoding is None:
+            return response
+
+        cacheable = request.method == "GET" and request.path.startswith(
+            tuple(settings.COMPRESSION_CACHE_PATHS)
+        )
+        compressed = self.compress(encoding, response.content, cacheable)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = encoding
+        # Compressed bytes differ from the original, so a strong ETag must weaken
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
+
+    @staticmethod
+    def compress(encoding, content, cacheable) -> bytes:
+        """ Compress content, reusing a cached result for cacheable responses """
+        level = settings.COMPRESSION_LEVELS[encoding]
+        if not cacheable:
+            return CODECS[encoding](content, level)
+
+        key = (encoding, level, hashlib.blake2b(content, digest_size=16).digest())
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = CODECS[encoding](content, level)
+            cache.set(key, compressed)
+        return compressed
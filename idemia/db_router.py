@@ -0,0 +1,136 @@
+"""
+Route reads to database read replicas.
+
+Reads go to a healthy replica from settings.DATABASE_REPLICAS unless the
+current request is pinned to the primary. Requests are pinned when they use
+an unsafe HTTP method, or when they carry the X-Last-Write header returned by
+a write made within the last settings.DATABASE_REPLICA_LAG_WINDOW seconds, so
+that clients read their own writes. Keeping the write time with the client
+means deciding where to read needs no shared state or primary query.
+Replicas that cannot be reached, or fail while running a query, are skipped
+for settings.DATABASE_REPLICA_RETRY_INTERVAL seconds, and a query that fails
+on a replica is run again on the primary.
+"""
+import contextlib
+import contextvars
+import logging
+import random
+import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import OperationalError
+
+LAST_WRITE_HEADER = "HTTP_X_LAST_WRITE"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+use_primary_var = contextvars.ContextVar("use_primary", default=False)
+
+# Monotonic time until which each unreachable replica alias is skipped
+_replica_down_until = {}
+
+
+def mark_replica_down(alias, error):
+    """ Take a replica out of rotation for the retry interval """
+    logging.warning("Read replica %s unavailable: %s", alias, error)
+    _replica_down_until[alias] = (
+        time.monotonic() + settings.DATABASE_REPLICA_RETRY_INTERVAL
+    )
+
+
+def replica_available(alias) -> bool:
+    """
+    Check that a replica accepts connections. Failures take the replica out
+    of rotation for the retry interval instead of failing the request.
+    """
+    if time.monotonic() < _replica_down_until.get(alias, 0):
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except OperationalError as error:
+        mark_replica_down(alias, error)
+        return False
+    return True
+
+
+def replica_fallback(execute, sql, params, many, context):
+    """
+    Execute wrapper for replica connections. If a query fails because the
+    replica went away after its connection was opened, take the replica out
+    of rotation and run the query on the primary through the same cursor.
+    """
+    try:
+        return execute(sql, params, many, context)
+    except OperationalError as error:
+        mark_replica_down(context["connection"].alias, error)
+        # Results are fetched through the CursorWrapper, so point it at a
+        # primary cursor; the broken replica connection is closed by Django
+        # at the end of the request because errors occurred on it
+        context["cursor"].cursor = connections[DEFAULT_DB_ALIAS].cursor().cursor
+        return execute(sql, params, many, context)
+
+
+def wrote_recently(last_write) -> bool:
+    """
+    Check whether an X-Last-Write header value, the Unix time of a client's
+    last write, falls within the replica lag window. Differences in either
+    direction are accepted so small clock skew between instances does no harm.
+    """
+    try:
+        age = time.time() - float(last_write)
+    except (TypeError, ValueError):
+        return False
+    return abs(age) < settings.DATABASE_REPLICA_LAG_WINDOW
+
+
+class PrimaryReplicaRouter:
+    """ Send writes to the primary and reads to a replica when it is safe """
+
+    def db_for_read(self, model, **hints):
+        if use_primary_var.get():
+            return DEFAULT_DB_ALIAS
+        replicas = list(settings.DATABASE_REPLICAS)
+        random.shuffle(replicas)
+        for alias in replicas:
+            if replica_available(alias):
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+
+class PrimaryPinMiddleware:
+    """
+    Pin a request's reads to the primary when it writes, or when it carries the
+    time of a recent write. Successful writes return their time in the
+    X-Last-Write header for clients to send back on their following requests.
+    Queries that fail on a replica during the request are retried on the primary.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        is_write = request.method not in SAFE_METHODS
+        pinned = is_write or wrote_recently(request.META.get(LAST_WRITE_HEADER))
+        token = use_primary_var.set(pinned)
+        try:
+            with contextlib.ExitStack() as stack:
+                for alias in settings.DATABASE_REPLICAS:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(replica_fallback)
+                    )
+                response = self.get_response(request)
+        finally:
+            use_primary_var.reset(token)
+
+        if is_write and response.status_code < 400:
+            response["X-Last-Write"] = "%.3f" % time.time()
+        return response
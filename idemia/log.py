@@ -0,0 +1,191 @@
+"""
+Non-blocking, structured logging for the Idemia microservice.
+
+Request threads hand log records to a bounded in-memory queue; a single
+listener thread per process formats them as JSON and writes them to the
+stream. If the log drain backs up, records are dropped (and counted) instead
+of blocking the request path.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+import uuid
+from django.core.signals import request_finished, request_started
+from django.dispatch import receiver
+
+REQUEST_ID_HEADER = "HTTP_X_REQUEST_ID"
+CSP_ID_HEADER = "HTTP_X_CONSUMER_CUSTOM_ID"
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+csp_id_var = contextvars.ContextVar("csp_id", default=None)
+
+
+class RequestContextFilter(logging.Filter):
+    """ Attach the current request and CSP IDs to every log record """
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        record.csp_id = csp_id_var.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """ Render log records as single-line JSON objects """
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + ".%03dZ" % record.msecs,
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "csp_id": getattr(record, "csp_id", None),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, separators=(",", ":"), default=str)
+
+
+class BlockingSentinelQueueListener(logging.handlers.QueueListener):
+    """ QueueListener that waits for room in a full queue when shutting down """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class QueueStreamHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler backed by a bounded queue and a background QueueListener
+    that writes to a StreamHandler. Formatting happens on the listener thread.
+    """
+
+    def __init__(self, maxsize=10000, stream=None):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.dropped = 0
+        self._unreported_drops = 0
+        self._drop_lock = threading.Lock()
+        self._stopped = False
+        self.target = logging.StreamHandler(stream)
+        self.listener = BlockingSentinelQueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def setFormatter(self, fmt):
+        """ Formatting is done by the listener's handler, not on the request thread """
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        """
+        Snapshot a copy of the record on the calling thread: merge args into the
+        message and render any traceback, since neither may be safe to defer.
+        The caller's record is left intact for any other handlers.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+                self._unreported_drops += 1
+            return
+
+        if self._unreported_drops:
+            with self._drop_lock:
+                count, self._unreported_drops = self._unreported_drops, 0
+            try:
+                self.queue.put_nowait(self._drop_record(count))
+            except queue.Full:
+                with self._drop_lock:
+                    self._unreported_drops += count
+
+    def _drop_record(self, count):
+        """ Build a warning record reporting log records lost to a full queue """
+        record = logging.LogRecord(
+            __name__,
+            logging.WARNING,
+            __file__,
+            0,
+            "Log queue full -- dropped %d log records (%d total)"
+            % (count, self.dropped),
+            None,
+            None,
+        )
+        record.request_id = None
+        record.csp_id = None
+        return record
+
+    def stop(self):
+        """ Write out any queued records and stop the listener thread """
+        with self._drop_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        self.listener.stop()
+
+    def close(self):
+        self.stop()
+        self.target.close()
+        super().close()
+
+
+@receiver(request_started)
+def bind_request_context(environ=None, **kwargs):
+    """
+    Bind a correlation ID and the calling CSP's ID to the logging context when
+    a request starts. They stay bound until request_finished, so lines Django
+    writes after the middleware returns (such as django.request warnings for
+    4xx and 5xx responses) carry them too. The correlation ID is taken from
+    the incoming X-Request-ID header when present.
+    """
+    environ = environ or {}
+    request_id_var.set(environ.get(REQUEST_ID_HEADER) or uuid.uuid4().hex)
+    csp_id_var.set(environ.get(CSP_ID_HEADER))
+
+
+@receiver(request_finished)
+def clear_request_context(**kwargs):
+    """ Unbind the request's IDs once its response has been sent """
+    request_id_var.set(None)
+    csp_id_var.set(None)
+
+
+class RequestContextMiddleware:
+    """
+    Echo the request's correlation ID back on the response. Requests handled
+    without request_started (e.g. built with RequestFactory) get their IDs
+    bound here instead.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        unbound = request_id_var.get() is None
+        if unbound:
+            bind_request_context(request.META)
+        request_id = request_id_var.get()
+        try:
+            response = self.get_response(request)
+        finally:
+            if unbound:
+                clear_request_context()
+        response["X-Request-ID"] = request_id
+        return response
@@ -0,0 +1,200 @@
+"""
+On-demand request profiling.
+
+When settings.PROFILING_ENABLED is set, requests carrying a valid signed
+X-Profile-Token header, or picked at settings.PROFILING_SAMPLE_RATE, are
+profiled by a sampling profiler that records the request thread's Python
+stacks every settings.PROFILING_INTERVAL seconds. Every SQL query run during
+the request is timed as well. Each profile is written as a JSON file to
+settings.PROFILING_DIR, which keeps only the newest settings.PROFILING_MAX_FILES
+profiles. When profiling is disabled the middleware removes itself from the
+stack. Use the `profiles` management command to read the results.
+"""
+import collections
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from idemia.log import csp_id_var, request_id_var
+
+TOKEN_HEADER = "HTTP_X_PROFILE_TOKEN"
+TOKEN_SALT = "idemia.profiling"
+TOKEN_VALUE = "profile"
+
+
+def make_token() -> str:
+    """ Create a signed value for the X-Profile-Token header """
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(TOKEN_VALUE)
+
+
+def valid_token(token) -> bool:
+    """ Check an X-Profile-Token header value's signature and age """
+    try:
+        value = signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+            token, max_age=settings.PROFILING_TOKEN_MAX_AGE
+        )
+    except signing.BadSignature:
+        return False
+    return value == TOKEN_VALUE
+
+
+def frame_name(frame) -> str:
+    """ Describe a stack frame as 'function (file.py:line)' """
+    code = frame.f_code
+    return "%s (%s:%d)" % (
+        code.co_name,
+        os.path.basename(code.co_filename),
+        code.co_firstlineno,
+    )
+
+
+class StackSampler:
+    """ Periodically record the Python stack of one thread, root frame first """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            # pylint: disable=protected-access
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class QueryRecorder:
+    """ Database execute wrapper that times every query. Parameters are not kept """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                {
+                    "alias": context["connection"].alias,
+                    "sql": sql,
+                    "duration": time.perf_counter() - start,
+                }
+            )
+
+
+def write_profile(profile, directory, max_files):
+    """ Save a profile and delete the oldest profiles beyond max_files """
+    os.makedirs(directory, exist_ok=True)
+    request_id = re.sub(r"[^A-Za-z0-9_-]", "", profile["request_id"])[:64]
+    name = "%d-%s.json" % (time.time_ns(), request_id)
+    path = os.path.join(directory, name)
+    try:
+        with open(path + ".tmp", "w") as profile_file:
+            json.dump(profile, profile_file)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        # Do not leave a partial file behind in a full directory
+        try:
+            os.remove(path + ".tmp")
+        except OSError:
+            pass
+        raise
+
+    for stale in list_profiles(directory)[:-max_files]:
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass  # Already pruned by another worker
+
+
+def list_profiles(directory) -> list:
+    """ Return the paths of saved profiles, oldest first """
+    if not os.path.isdir(directory):
+        return []
+    return [
+        os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if name.endswith(".json")
+    ]
+
+
+def load_profile(path) -> dict:
+    """ Read a saved profile """
+    with open(path) as profile_file:
+        return json.load(profile_file)
+
+
+class ProfilingMiddleware:
+    """ Profile requests selected by a signed header or by random sampling """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def should_profile(self, request) -> bool:
+        """ Decide whether to profile a request """
+        token = request.META.get(TOKEN_HEADER)
+        if token:
+            return valid_token(token)
+        rate = settings.PROFILING_SAMPLE_RATE
+        return rate > 0 and random.random() < rate  # nosec - not security related
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        sampler = StackSampler(threading.get_ident(), settings.PROFILING_INTERVAL)
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                sampler.stop()
+        duration = time.perf_counter() - start
+
+        profile = {
+            "request_id": request_id_var.get() or "unknown",
+            "csp_id": csp_id_var.get(),
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration": duration,
+            "interval": settings.PROFILING_INTERVAL,
+            "stacks": dict(sampler.stacks),
+            "queries": recorder.queries,
+        }
+        try:
+            write_profile(profile, settings.PROFILING_DIR, settings.PROFILING_MAX_FILES)
+        except OSError as error:
+            # A full or unwritable profile directory must not fail the request
+            logging.error("Cannot save request profile: %s", error)
+        return response
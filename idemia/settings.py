@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 from cfenv import AppEnv
 
@@ -29,8 +30,11 @@ DEBUG = os.environ.get("DEBUG", "False") == "True"
 # Static file settings
 STATIC_URL = "/static/"
 STATIC_ROOT = os.path.join(BASE_DIR, "idemia/static")
+# Hashed filenames are served with far-future immutable caching, and gzip and
+# brotli variants are written by collectstatic alongside each file
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
-STATICFILES_STORAGE = "whitenoise.storage.CompressedStaticFilesStorage"
+# Fall back to unhashed names for files missing from the manifest
+WHITENOISE_MANIFEST_STRICT = False
 
 # Set production renderer to JSONRenderer instead of the browsable API
 if not DEBUG:
@@ -55,6 +59,11 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "idemia.log.RequestContextMiddleware",
+    "idemia.compression.CompressionMiddleware",
+    "idemia.admission.AdmissionControlMiddleware",
+    "idemia.profiling.ProfilingMiddleware",
+    "idemia.db_router.PrimaryPinMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -64,6 +73,68 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Per-CSP admission control. See idemia/admission.py
+ADMISSION_CONTROL_ENABLED = (
+    os.environ.get("ADMISSION_CONTROL_ENABLED", "True") == "True"
+)
+# Sustained requests per second and burst size allowed for each CSP
+ADMISSION_RATE = float(os.environ.get("ADMISSION_RATE", "50"))
+ADMISSION_BURST = float(os.environ.get("ADMISSION_BURST", "100"))
+# Concurrent requests allowed for each CSP across all workers on an instance. At
+# most 16 worker processes can hold one CSP's requests at a time.
+ADMISSION_MAX_CONCURRENT = int(os.environ.get("ADMISSION_MAX_CONCURRENT", "4"))
+# Seconds a request over the concurrency cap waits for a slot before a 429
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "0.25"))
+# Shared state file (named for its layout version) and the number of CSPs it
+# can track. The file is kept in the container's own /dev/shm when there is one,
+# which no other users share, so a fixed name there is safe (bandit B108).
+ADMISSION_STATE_FILE = os.environ.get(
+    "ADMISSION_STATE_FILE",
+    os.path.join(
+        "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),  # nosec
+        "idemia-admission-2",
+    ),
+)
+ADMISSION_SLOTS = int(os.environ.get("ADMISSION_SLOTS", "256"))
+
+# On-demand request profiling. See idemia/profiling.py
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "False") == "True"
+# Fraction of requests profiled without an X-Profile-Token header
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", "0"))
+# Seconds between stack samples
+PROFILING_INTERVAL = float(os.environ.get("PROFILING_INTERVAL", "0.005"))
+# Seconds an X-Profile-Token header value remains valid
+PROFILING_TOKEN_MAX_AGE = int(os.environ.get("PROFILING_TOKEN_MAX_AGE", "3600"))
+# Directory holding saved profiles and the number of profiles kept
+PROFILING_DIR = os.environ.get(
+    "PROFILING_DIR", os.path.join(tempfile.gettempdir(), "idemia-profiles")
+)
+PROFILING_MAX_FILES = int(os.environ.get("PROFILING_MAX_FILES", "100"))
+
+# Compiled ZIP code and site reference data for /locations. Built with the
+# build_locations management command. Dummy locations are returned when unset.
+LOCATIONS_DATA_FILE = os.environ.get("LOCATIONS_DATA_FILE", "")
+# Seconds between checks for a replaced location data file
+LOCATIONS_RELOAD_INTERVAL = float(os.environ.get("LOCATIONS_RELOAD_INTERVAL", "30"))
+# Number of sites returned by /locations
+LOCATIONS_RESULT_LIMIT = int(os.environ.get("LOCATIONS_RESULT_LIMIT", "5"))
+
+# Response compression. See idemia/compression.py
+# Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+# Level for each encoding, chosen with the benchmark_compression command
+COMPRESSION_LEVELS = {
+    "br": int(os.environ.get("COMPRESSION_BROTLI_LEVEL", "5")),
+    "zstd": int(os.environ.get("COMPRESSION_ZSTD_LEVEL", "3")),
+    "gzip": int(os.environ.get("COMPRESSION_GZIP_LEVEL", "6")),
+}
+# GET responses under these path prefixes have their compressed bodies cached
+COMPRESSION_CACHE_PATHS = os.environ.get(
+    "COMPRESSION_CACHE_PATHS", "/locations/,/doc,/redoc/"
+).split(",")
+# Total size of compressed bodies cached by each worker
+COMPRESSION_CACHE_BYTES = int(os.environ.get("COMPRESSION_CACHE_BYTES", "8388608"))
+
 ROOT_URLCONF = "idemia.urls"
 
 TEMPLATES = [
@@ -88,20 +159,42 @@ WSGI_APPLICATION = "idemia.wsgi.application"
 # populated with service information needed to connect to the database.
 VCAP_ENV_VAR = "VCAP_APPLICATION"
 
-if VCAP_ENV_VAR in os.environ:
-    # Deployment to Cloud.gov -- Set DB to RDS
-    ENV = AppEnv()
-    RDS_VARS = ENV.get_service(label="aws-rds")
-    DB_INFO = RDS_VARS.credentials
+# Comma-separated list of read replicas. On cloud.gov these are the names of
+# bound aws-rds services; locally they are host:port pairs of postgres servers
+# that share the local development credentials.
+DATABASE_REPLICA_NAMES = [
+    name.strip()
+    for name in os.environ.get("DATABASE_REPLICAS", "").split(",")
+    if name.strip()
+]
 
-    DB_DICT = {
+
+def rds_db_dict(service):
+    """ Build a Django database configuration from a bound aws-rds service """
+    db_info = service.credentials
+    return {
         "ENGINE": "django.db.backends.postgresql",
-        "NAME": DB_INFO["db_name"],
-        "USER": DB_INFO["username"],
-        "PASSWORD": DB_INFO["password"],
-        "HOST": DB_INFO["host"],
-        "PORT": DB_INFO["port"],
+        "NAME": db_info["db_name"],
+        "USER": db_info["username"],
+        "PASSWORD": db_info["password"],
+        "HOST": db_info["host"],
+        "PORT": db_info["port"],
     }
+
+
+if VCAP_ENV_VAR in os.environ:
+    # Deployment to Cloud.gov -- Set DB to RDS
+    ENV = AppEnv()
+    RDS_VARS = next(
+        service
+        for service in ENV.services
+        if service.env.get("label") == "aws-rds"
+        and service.name not in DATABASE_REPLICA_NAMES
+    )
+    DB_DICT = rds_db_dict(RDS_VARS)
+    REPLICA_DICTS = [
+        rds_db_dict(ENV.get_service(name=name)) for name in DATABASE_REPLICA_NAMES
+    ]
 else:
     # Local development -- use local DB info
     # See README for setting up postgres container
@@ -113,11 +206,53 @@ else:
         "HOST": "127.0.0.1",
         "PORT": "5432",
     }
+    REPLICA_DICTS = []
+    for replica in DATABASE_REPLICA_NAMES:
+        host, _, port = replica.partition(":")
+        REPLICA_DICTS.append({**DB_DICT, "HOST": host, "PORT": port or "5432"})
 
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 DATABASES = {"default": DB_DICT}
 
+# Read replicas are registered as replica_0, replica_1, ... and mirror the
+# default database during tests. See idemia/db_router.py for routing rules.
+# Replica connections are kept open between requests, so reads do not wait on a
+# new connection each time; a broken one is retried on the primary and closed.
+DATABASE_REPLICA_CONN_MAX_AGE = int(
+    os.environ.get("DATABASE_REPLICA_CONN_MAX_AGE", "60")
+)
+DATABASE_REPLICAS = []
+for index, replica_dict in enumerate(REPLICA_DICTS):
+    alias = "replica_%d" % index
+    DATABASES[alias] = {
+        **replica_dict,
+        "CONN_MAX_AGE": DATABASE_REPLICA_CONN_MAX_AGE,
+        "OPTIONS": {"connect_timeout": 2},
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["idemia.db_router.PrimaryReplicaRouter"]
+# Tests run with replica routing turned off. See idemia/test_runner.py
+TEST_RUNNER = "idemia.test_runner.TestRunner"
+
+# Seconds after a write during which reads sending its X-Last-Write header back
+# are sent to the primary
+DATABASE_REPLICA_LAG_WINDOW = int(os.environ.get("DATABASE_REPLICA_LAG_WINDOW", "5"))
+# Seconds an unreachable replica is skipped before it is tried again
+DATABASE_REPLICA_RETRY_INTERVAL = int(
+    os.environ.get("DATABASE_REPLICA_RETRY_INTERVAL", "30")
+)
+
+# Monthly partitions of api_enrollmentrecord. See api/partitioning.py
+# Months of partitions created ahead of the current month
+ENROLLMENT_PARTITION_MONTHS_AHEAD = int(
+    os.environ.get("ENROLLMENT_PARTITION_MONTHS_AHEAD", "3")
+)
+# Months of enrollment records kept by `enrollment_partitions expire`
+ENROLLMENT_RETENTION_MONTHS = int(os.environ.get("ENROLLMENT_RETENTION_MONTHS", "0"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -156,19 +291,29 @@ if DEBUG:
     DEBUG_LEVEL = "DEBUG"
 else:
     DEBUG_LEVEL = "INFO"
+# Maximum number of log records buffered in memory before new records are dropped
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
+    "filters": {
+        "request_context": {
+            "()": "idemia.log.RequestContextFilter",
+        }
+    },
     "formatters": {
-        "app_format": {
-            "format": '{levelname}:{module}:"{message}"',
-            "style": "{",
+        "json": {
+            "()": "idemia.log.JSONFormatter",
         }
     },
     "handlers": {
+        # Records are queued on the request thread and written by a listener thread
         "console": {
-            "class": "logging.StreamHandler",
-            "formatter": "app_format",
+            "class": "idemia.log.QueueStreamHandler",
+            "formatter": "json",
+            "filters": ["request_context"],
+            "maxsize": LOG_QUEUE_SIZE,
         },
     },
     "loggers": {
@@ -0,0 +1,34 @@
+"""
+Test runner for the Idemia microservice.
+
+Keeps the test suite independent of infrastructure configured in the
+environment it runs in. Replica aliases mirror the default test database, but
+test cases only allow queries on the default alias, so reads are not routed to
+replicas; tests of the routing itself set DATABASE_REPLICAS. Admission control
+keeps its shared state in a file of its own for the run, so token buckets do
+not persist between runs or mix with those of a local server.
+"""
+import os
+import tempfile
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """ DiscoverRunner that turns off environment-specific behaviour for tests """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._saved_settings = {
+            "DATABASE_REPLICAS": settings.DATABASE_REPLICAS,
+            "ADMISSION_STATE_FILE": settings.ADMISSION_STATE_FILE,
+        }
+        self._state_dir = tempfile.TemporaryDirectory(prefix="idemia-test-")
+        settings.DATABASE_REPLICAS = []
+        settings.ADMISSION_STATE_FILE = os.path.join(self._state_dir.name, "admission")
+
+    def teardown_test_environment(self, **kwargs):
+        for name, value in self._saved_settings.items():
+            setattr(settings, name, value)
+        self._state_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
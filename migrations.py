@@ -16,4 +16,13 @@ ENV = AppEnv()
 if ENV.index == 0:
     logging.warning("Instance index 0 started -- running migrations script")
     execute_from_command_line(["manage.py", "migrate"])
+    if os.environ.get("ENROLLMENT_PARTITIONING") == "True":
+        # Set once the table has been converted with 'enrollment_partitions
+        # convert'. Make sure partitions exist for the coming months. Records
+        # still go to the default partition without them, so a failure must not
+        # stop startup.
+        try:
+            execute_from_command_line(["manage.py", "enrollment_partitions", "create"])
+        except (Exception, SystemExit):  # pylint: disable=broad-except
+            logging.exception("Creating enrollment record partitions failed")
     logging.warning("Migrations complete")